@@ -1,4 +1,8 @@
 import logging
+from logging.handlers import QueueHandler, QueueListener
+import queue
+import threading
+import time
 
 import sublime
 
@@ -6,12 +10,81 @@ import sublime
 DEFAULT_LOG_LEVEL = logging.WARNING
 DEFAULT_LOG_LEVEL_NAME = logging.getLevelName(DEFAULT_LOG_LEVEL)
 EVENT_LEVEL = logging.INFO
+# Records waiting to be written, beyond which new ones are dropped
+LOG_QUEUE_SIZE = 1000
+
+
+class DroppingQueueHandler(QueueHandler):
+
+    """Queues records without blocking, counting those dropped while the queue is full.
+
+    Records are formatted by the listener's handler on its thread, not here,
+    so arguments must not be modified after logging them.
+    """
+
+    def __init__(self, queue):
+        super().__init__(queue)
+        self.dropped = 0
+        self._unreported = 0
+
+    def prepare(self, record):
+        return record
+
+    def enqueue(self, record):
+        try:
+            if self._unreported:
+                self.queue.put_nowait(logging.makeLogRecord({
+                    'name': __name__, 'levelno': logging.WARNING, 'levelname': 'WARNING',
+                    'msg': "Dropped %d log messages", 'args': (self._unreported,),
+                }))
+                self._unreported = 0
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+            self._unreported += 1
+
+
+class PayloadRateLimit(logging.Filter):
+
+    """Lets through at most `rate` payload dumps per second for each message.
+
+    Payload dumps are records logged with `extra={'payload_dump': True}`.
+    A `rate` of 0 disables the limit.
+    """
+
+    def __init__(self, rate=0):
+        super().__init__()
+        self.rate = rate
+        self.suppressed = 0
+        # message -> (start of the current second, records let through during it)
+        self._windows = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        if not self.rate or not getattr(record, 'payload_dump', False):
+            return True
+        now = time.monotonic()
+        with self._lock:
+            started, count = self._windows.get(record.msg, (now, 0))
+            if now - started >= 1:
+                started, count = now, 0
+            if count >= self.rate:
+                self.suppressed += 1
+                return False
+            self._windows[record.msg] = (started, count + 1)
+        return True
+
 
 pkg_logger = logging.getLogger(__package__)
 handler = logging.StreamHandler()
 formatter = logging.Formatter(fmt="[{name}] {levelname}: {message}", style='{')
 handler.setFormatter(formatter)
-pkg_logger.addHandler(handler)
+# Records are written by the listener's thread, so logging never waits for the console
+queue_handler = DroppingQueueHandler(queue.Queue(LOG_QUEUE_SIZE))
+payload_rate_limit = PayloadRateLimit()
+queue_handler.addFilter(payload_rate_limit)
+listener = QueueListener(queue_handler.queue, handler)
+pkg_logger.addHandler(queue_handler)
 pkg_logger.setLevel(DEFAULT_LOG_LEVEL)
 
 logger = logging.getLogger(__name__)
@@ -21,12 +94,32 @@ def _settings():
     return sublime.load_settings("DiscordRichPresence.sublime-settings")
 
 
+def _stop_listener():
+    while True:
+        try:
+            listener.stop()
+            return
+        except queue.Full:
+            # The sentinel did not fit, wait for the listener to catch up
+            time.sleep(0.01)
+
+
+def _payload_rate_limit_setting():
+    rate = _settings().get('log_payload_rate_limit', 0)
+    if isinstance(rate, bool) or not isinstance(rate, (int, float)) or rate < 0:
+        logger.error("Setting `log_payload_rate_limit` has an invalid value %r, using 0 instead",
+                     rate)
+        return 0
+    return rate
+
+
 def plugin_loaded():
     def on_settings_reload():
         cur_log_level = pkg_logger.getEffectiveLevel()
         cur_log_level_name = logging.getLevelName(cur_log_level)
         new_log_level_name = _settings().get('log_level', DEFAULT_LOG_LEVEL_NAME).upper()
         new_log_level = getattr(logging, new_log_level_name, DEFAULT_LOG_LEVEL)
+        payload_rate_limit.rate = _payload_rate_limit_setting()
 
         if new_log_level_name != cur_log_level_name:
             if cur_log_level > EVENT_LEVEL and new_log_level <= EVENT_LEVEL:
@@ -37,10 +130,12 @@ def plugin_loaded():
                        cur_log_level_name, new_log_level_name)
             pkg_logger.setLevel(new_log_level)  # Just set it again to be sure
 
+    listener.start()
     _settings().add_on_change(__name__, on_settings_reload)
     on_settings_reload()  # trigger on inital settings load, too
 
 
 def plugin_unloaded():
     _settings().clear_on_change(__name__)
-    pkg_logger.removeHandler(handler)
+    pkg_logger.removeHandler(queue_handler)
+    _stop_listener()
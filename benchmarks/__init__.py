@@ -0,0 +1,7 @@
+# Micro-benchmarks for the plugin's hot paths.
+#
+# Run from the repository root, e.g.:
+#
+#   python -m benchmarks.bench_icons
+#
+# These are not shipped to users (see .gitattributes).
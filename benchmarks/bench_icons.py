@@ -0,0 +1,127 @@
+"""Compare `IconResolver.resolve` against the previous nested-loop `get_icon`.
+
+Also checks the icons found from scopes that the previous resolver missed.
+"""
+
+import timeit
+
+from helpers.icons import ICONS, SCOPES, IconResolver, UNKNOWN_ICON
+
+# (file name, first scope of the view)
+CORPUS = [
+    ('drp.py', 'source.python meta.statement'),
+    ('__init__.py', 'source.python'),
+    ('index.js', 'source.js'),
+    ('App.tsx', 'source.tsx meta.jsx'),
+    ('main.rs', 'source.rust'),
+    ('README.md', 'text.html.markdown meta.block'),
+    ('CMakeLists.txt', 'source.cmake'),
+    ('Makefile', 'source.makefile'),
+    ('LICENSE', 'text.plain'),
+    ('style.scss', 'source.scss'),
+    ('index.html', 'text.html.basic'),
+    ('template.jinja2', 'text.html.jinja'),
+    ('Main.java', 'source.java'),
+    ('build.gradle', 'source.groovy'),
+    ('config.yaml', 'source.yaml'),
+    ('Cargo.toml', 'source.toml'),
+    ('server.go', 'source.go'),
+    ('lib.ex', 'source.elixir'),
+    ('App.scala', 'source.scala'),
+    ('sketch.pde', 'source.pde'),
+    ('vector.hpp', 'source.c++'),
+    ('query.sql', 'source.sql'),
+    ('script.ps1', 'source.powershell'),
+    ('notes.org', 'text.orgmode'),
+    ('module.erl', 'source.erlang'),
+    ('Dockerfile', 'source.dockerfile'),
+    ('paper.tex', 'text.tex.latex'),
+    ('build.xml', 'text.xml'),
+    ('DiscordRichPresence.sublime-settings', 'source.json.sublime.settings'),
+    ('plugin.v', 'source.v'),
+]
+
+
+# (file name, scope at the start of the view, expected icon)
+# for files whose extension is unknown, so the icon comes from the scope
+SCOPE_CORPUS = [
+    ('README', 'text.html.markdown meta.paragraph.markdown', 'markdown'),
+    ('script', 'source.js.embedded.html', 'javascript'),
+    ('page', 'text.html.basic source.js.embedded.html', 'html'),
+    ('App', 'text.html.vue', 'vue'),
+    ('build', 'source.shell.bash', 'shell'),
+    ('index', 'embedding.php text.html.php', 'php'),
+    ('vector', 'source.c++', 'cpp'),
+    ('Component', 'source.tsx meta.jsx', 'react'),
+    ('settings', 'source.json.sublime.settings', 'json'),
+    ('Program', 'source.python', 'python'),
+    ('notes', 'text.orgmode', UNKNOWN_ICON),
+    ('unknown', 'comment.line source.lua', 'lua'),
+]
+
+
+def yield_subscopes(scope):
+    last_dot = len(scope)
+    while last_dot > 0:
+        yield scope[:last_dot]
+        last_dot = scope[:last_dot].rfind('.')
+
+
+def legacy_get_icon(file, ext, _scope):
+    """The resolver as it was before the lookup tables (minus the URL)."""
+    main_scope = _scope.split()[0]
+    try:
+        sub_scope = '.'.join(main_scope.split()[0].split('.')[1::])
+    except Exception:
+        sub_scope = ''
+
+    icon = UNKNOWN_ICON
+    for _icon in ICONS:
+        if ext in _icon.split(','):
+            icon = ICONS[_icon]
+            break
+        else:
+            for scope in yield_subscopes(sub_scope):
+                if scope.replace(',', '') in SCOPES:
+                    icon = scope.replace(',', '')
+                    break
+                else:
+                    icon = UNKNOWN_ICON
+
+    if file == 'LICENSE':
+        icon = 'license'
+    return icon
+
+
+def main(number=2000):
+    entries = [(file, file.split('.')[-1], scope) for file, scope in CORPUS]
+    resolver = IconResolver()
+
+    for entry in entries:
+        expected = legacy_get_icon(*entry)
+        actual = resolver.resolve(*entry)
+        # The previous resolver only looked at the first scope and missed some
+        assert expected == actual or expected == UNKNOWN_ICON, (entry, expected, actual)
+
+    for file, scope, expected in SCOPE_CORPUS:
+        actual = IconResolver().resolve(file, '', scope, 'Packages/%s.sublime-syntax' % file)
+        assert expected == actual, (file, scope, expected, actual)
+
+    def run_legacy():
+        for entry in entries:
+            legacy_get_icon(*entry)
+
+    def run_resolver():
+        for entry in entries:
+            resolver.resolve(*entry)
+
+    legacy = min(timeit.repeat(run_legacy, number=number, repeat=5))
+    current = min(timeit.repeat(run_resolver, number=number, repeat=5))
+    lookups = number * len(entries)
+    print("legacy get_icon:  %8.3f us/lookup" % (legacy / lookups * 1e6))
+    print("IconResolver:     %8.3f us/lookup" % (current / lookups * 1e6))
+    print("speedup:          %8.1fx" % (legacy / current))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,110 @@
+"""Cost of the {size}/{sizehf}/{loc} fields per event on huge buffers.
+
+Compares computing the metrics on every event,
+as handle_activity used to, against BufferMetricsCache
+with incremental updates from text changes.
+"""
+
+import random
+import time
+
+from helpers.metrics import BufferMetricsCache
+
+
+class FakeView:
+
+    """Just enough of `sublime.View` for the metrics.
+
+    `rowcol` scans the text like a buffer without a line index would,
+    which makes the cost of a full computation visible.
+    """
+
+    def __init__(self, text):
+        self.text = text
+        self._change_count = 0
+
+    def buffer_id(self):
+        return 1
+
+    def change_count(self):
+        return self._change_count
+
+    def size(self):
+        return len(self.text)
+
+    def rowcol(self, point):
+        return self.text.count('\n', 0, point), 0
+
+    def insert(self, point, string):
+        """Insert text and return the corresponding TextChange."""
+        change = FakeTextChange(self._position(point), self._position(point), string)
+        self.text = self.text[:point] + string + self.text[point:]
+        self._change_count += 1
+        return change
+
+    def _position(self, point):
+        return FakeHistoricPosition(point, self.rowcol(point)[0])
+
+
+class FakeHistoricPosition:
+
+    def __init__(self, pt, row):
+        self.pt = pt
+        self.row = row
+
+
+class FakeTextChange:
+
+    def __init__(self, a, b, string):
+        self.a = a
+        self.b = b
+        self.str = string
+
+
+def make_text(size):
+    line = "2023-01-01 12:00:00 INFO some.logger: a log message of moderate length\n"
+    return line * (size // len(line))
+
+
+def legacy_metrics(view):
+    return view.size(), view.rowcol(view.size())[0] + 1
+
+
+def bench(size_mb, events=50):
+    view = FakeView(make_text(size_mb * 1024 * 1024))
+    cache = BufferMetricsCache()
+    cache.get(view)
+    change_count = view.change_count()
+
+    legacy = cached = incremental = 0.0
+    rng = random.Random(42)
+    for _ in range(events):
+        # One edit between events, as when saving after typing
+        change = view.insert(rng.randrange(view.size()), "new line\n")
+        started = time.perf_counter()
+        cache.apply_changes(1, change_count, view.change_count(), [change])
+        incremental += time.perf_counter() - started
+        change_count = view.change_count()
+
+        started = time.perf_counter()
+        expected = legacy_metrics(view)
+        legacy += time.perf_counter() - started
+
+        started = time.perf_counter()
+        metrics = cache.get(view)
+        cached += time.perf_counter() - started
+        assert (metrics.size, metrics.lines) == expected, ((metrics.size, metrics.lines), expected)
+
+    print("%4d MB buffer: full computation %9.1f us/event, cache %6.2f us/event"
+          " + %6.2f us/edit to apply changes (%d misses)"
+          % (size_mb, legacy / events * 1e6, cached / events * 1e6,
+             incremental / events * 1e6, cache.misses))
+
+
+def main():
+    for size_mb in (1, 16, 128):
+        bench(size_mb)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,102 @@
+"""Compare the buffered frame reader against the previous concatenating reader.
+
+Reports the time, read syscalls and bytes copied while assembling frames, per frame.
+Times are the best of several runs, alternating between the readers.
+Requires a platform with Unix sockets.
+"""
+
+import json
+import logging
+import struct
+import time
+
+from discord_ipc import UnixDiscordIpcClient
+
+from .fake_discord import FakeDiscordServer
+
+CLIENT_ID = '389368374645227520'
+REPEAT = 5
+
+
+class CountingClient(UnixDiscordIpcClient):
+
+    def _iter_connections(self, deadline):
+        self.reads = 0
+        self.copied = 0
+        return super()._iter_connections(deadline)
+
+    def _recv_into(self, buffer, deadline):
+        self.reads += 1
+        return super()._recv_into(buffer, deadline)
+
+    def _fill(self, deadline):
+        # Moving a partial header to the front or a partial frame to its own buffer copies it
+        if (self._rstart != self._rend
+                and self._rstart + max(self._rneeded, 8) > len(self._rbuf)):
+            self.copied += self._rend - self._rstart
+        super()._fill(deadline)
+
+
+class LegacyClient(CountingClient):
+
+    """The reader as it was before the receive buffer."""
+
+    def _recv(self, size):
+        self.reads += 1
+        return self._sock.recv(size)
+
+    def _recv_exactly(self, size):
+        buf = b""
+        size_remaining = size
+        while size_remaining:
+            chunk = self._recv(size_remaining)
+            buf += chunk
+            self.copied += len(buf)
+            size_remaining -= len(chunk)
+        return buf
+
+    def recv(self, deadline=None):
+        op, length = struct.unpack("<II", self._recv_exactly(8))
+        payload = self._recv_exactly(length)
+        return op, json.loads(payload.decode('utf-8'))
+
+
+def run(client_cls, count, size, rounds):
+    client = client_cls(CLIENT_ID)
+    try:
+        client.reads = client.copied = 0
+        started = time.perf_counter()
+        for i in range(rounds):
+            client.send({'cmd': 'BENCH_STREAM', 'args': {'count': count, 'size': size},
+                         'nonce': str(i)})
+            while client.recv()[1]['nonce'] != str(i):
+                pass
+        elapsed = time.perf_counter() - started
+    finally:
+        client.close()
+    frames = rounds * (count + 1)
+    return elapsed / frames, client.reads / frames, client.copied / frames
+
+
+def main():
+    scenarios = [
+        ('small frames', 200, 64, 50),
+        ('READY-sized frames', 20, 8 * 1024, 50),
+        ('large frames', 2, 1024 * 1024, 10),
+    ]
+    logging.getLogger('discord_ipc').setLevel(logging.ERROR)
+    with FakeDiscordServer():
+        for name, count, size, rounds in scenarios:
+            print("%s (%d x %d bytes)" % (name, count, size))
+            results = {}
+            for _ in range(REPEAT):
+                for client_cls in (LegacyClient, CountingClient):
+                    result = run(client_cls, count, size, rounds)
+                    results[client_cls] = min(results.get(client_cls, result), result)
+            for client_cls, (per_frame, reads, copied) in results.items():
+                print("  %-14s %9.2f us/frame %8.2f reads/frame %12.0f bytes copied/frame"
+                      % (client_cls.__name__, per_frame * 1e6, reads, copied))
+
+
+if __name__ == '__main__':
+    main()
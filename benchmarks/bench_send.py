@@ -0,0 +1,87 @@
+"""Compare framed writes against the previous header-then-payload writes.
+
+Reports write calls and throughput for single frames and batches.
+Requires a platform with Unix sockets.
+"""
+
+import json
+import logging
+import struct
+import time
+
+from discord_ipc import NO_DEADLINE, OP_FRAME, UnixDiscordIpcClient
+
+from .fake_discord import FakeDiscordServer
+
+CLIENT_ID = '389368374645227520'
+
+ACTIVITY = {
+    'assets': {
+        'large_image': 'https://raw.githubusercontent.com/Snazzah/SublimeDiscordRP/master/icons/lang-python.png',
+        'large_text': 'Python',
+        'small_image': 'sublime3',
+        'small_text': 'Sublime Text v4180',
+    },
+    'details': 'Editing drp.py for Project SublimeDiscordRP',
+    'state': 'Size: 12.3KB',
+    'timestamps': {'start': 1700000000},
+}
+
+
+class CountingClient(UnixDiscordIpcClient):
+
+    def _iter_connections(self, deadline):
+        self.writes = 0
+        return super()._iter_connections(deadline)
+
+    def _write(self, data, deadline):
+        self.writes += 1
+        super()._write(data, deadline)
+
+
+class LegacyClient(CountingClient):
+
+    """The writer as it was before frames were built in one buffer."""
+
+    def send_many(self, frames, *, deadline=NO_DEADLINE):
+        for op, data in frames:
+            data_bytes = json.dumps(data, separators=(',', ':')).encode('utf-8')
+            self._write(struct.pack("<II", op, len(data_bytes)), deadline)
+            self._write(data_bytes, deadline)
+
+
+def sink_frame(i):
+    return OP_FRAME, {'cmd': 'BENCH_SINK', 'args': {'activity': ACTIVITY}, 'nonce': str(i)}
+
+
+def run(client_cls, count, batch):
+    client = client_cls(CLIENT_ID)
+    try:
+        client.writes = 0
+        started = time.perf_counter()
+        if batch:
+            client.send_many([sink_frame(i) for i in range(count)])
+        else:
+            for i in range(count):
+                client.send(sink_frame(i)[1])
+        # Wait for the server to have consumed everything
+        client.send_recv({'cmd': 'PING', 'nonce': 'done'})
+        elapsed = time.perf_counter() - started
+    finally:
+        client.close()
+    return count / elapsed, client.writes / count
+
+
+def main(count=20000):
+    logging.getLogger('discord_ipc').setLevel(logging.ERROR)
+    with FakeDiscordServer():
+        for batch in (False, True):
+            print("batched send_many" if batch else "one send per frame")
+            for client_cls in (LegacyClient, CountingClient):
+                throughput, writes = run(client_cls, count, batch)
+                print("  %-14s %10.0f frames/s %8.4f writes/frame"
+                      % (client_cls.__name__, throughput, writes))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,117 @@
+"""Fault injection checks for the IPC client's deadlines.
+
+Runs the client against a fake Discord that stalls, writes half a frame
+or closes the connection mid-frame, and verifies that no operation
+blocks past its deadline,
+including the total deadline of connecting and the handshake,
+and that an endpoint that never completes the handshake is skipped.
+Exits with a non-zero status on failure.
+Requires a platform with Unix sockets,
+so only the Unix client is covered, not the Windows named pipe client.
+"""
+
+import logging
+import sys
+import time
+from functools import partial
+
+from discord_ipc import DiscordIpcClient, DiscordIpcError, DiscordIpcTimeout, PipelinedIpcClient
+
+from .fake_discord import FakeDiscordServer
+
+CLIENT_ID = '389368374645227520'
+TIMEOUT = 0.3
+# Allowed overshoot of a deadline
+SLACK = 0.2
+
+
+def connect(**timeouts):
+    options = dict(connect_timeout=TIMEOUT, handshake_timeout=TIMEOUT, timeout=TIMEOUT)
+    options.update(timeouts)
+    return DiscordIpcClient.for_platform(CLIENT_ID, **options)
+
+
+def check_handshake(fault, **timeouts):
+    expected = ConnectionResetError if fault == 'close_mid_frame' else DiscordIpcTimeout
+    with FakeDiscordServer(fault=fault):
+        started = time.monotonic()
+        try:
+            connect(**timeouts)
+        except expected:
+            pass
+        else:
+            return "connected despite fault"
+        return time.monotonic() - started
+
+
+def check_connection(fault):
+    """The handshake alone may take longer than the total deadline allows."""
+    return check_handshake(fault, handshake_timeout=10 * TIMEOUT, connection_timeout=TIMEOUT)
+
+
+def check_stale_endpoint():
+    """A stalled handshake moves on to the next endpoint within the total deadline."""
+    with FakeDiscordServer(stale=True) as server:
+        started = time.monotonic()
+        try:
+            client = connect(connection_timeout=3 * TIMEOUT)
+        except DiscordIpcError as e:
+            return "failed to connect: %r" % e
+        client._close()
+        if client.path != server.path:
+            return "connected to %r" % client.path
+        return time.monotonic() - started
+
+
+def check_request(fault):
+    expected = ConnectionResetError if fault == 'close_mid_frame' else DiscordIpcTimeout
+    with FakeDiscordServer(fault=fault, fault_on='request'):
+        client = connect()
+        started = time.monotonic()
+        try:
+            client.set_activity({'state': 'Testing'})
+        except expected:
+            pass
+        else:
+            return "request completed despite fault"
+        finally:
+            client._close()
+        return time.monotonic() - started
+
+
+def check_pipelined_request(fault):
+    expected = ConnectionResetError if fault == 'close_mid_frame' else DiscordIpcTimeout
+    with FakeDiscordServer(fault=fault, fault_on='request'):
+        client = PipelinedIpcClient(connect())
+        started = time.monotonic()
+        try:
+            exc = client.set_activity({'state': 'Testing'}, timeout=TIMEOUT).exception(TIMEOUT + SLACK)
+        finally:
+            client.client._close()
+        if not isinstance(exc, expected):
+            return "expected %s, got %r" % (expected.__name__, exc)
+        return time.monotonic() - started
+
+
+def main():
+    logging.getLogger('discord_ipc').setLevel(logging.CRITICAL)
+    failed = False
+    cases = [(check.__name__, fault, partial(check, fault))
+             for check in (check_handshake, check_connection, check_request, check_pipelined_request)
+             for fault in FakeDiscordServer.FAULTS]
+    cases.append(('check_stale_endpoint', 'stall', check_stale_endpoint))
+    for name, fault, check in cases:
+        result = check()
+        if isinstance(result, str):
+            ok = False
+            detail = result
+        else:
+            ok = result <= TIMEOUT + SLACK
+            detail = "returned after %.3fs (deadline %.1fs)" % (result, TIMEOUT)
+        failed |= not ok
+        print("%-4s %-24s %-16s %s" % ("ok" if ok else "FAIL", name, fault, detail))
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,182 @@
+"""Correctness and speed of the SET_ACTIVITY encoder.
+
+Every sequence of activities in the corpus is encoded with one `ActivityEncoder`,
+so later activities reuse the JSON cached for earlier ones,
+and each payload is compared byte for byte against `json.dumps` of the full payload,
+as the client serialized it before.
+Then both are timed on the updates of a typical editing session,
+including the nonce and framing.
+
+Exits with a non-zero status if any check fails.
+"""
+
+import json
+import os
+import struct
+import sys
+import timeit
+import uuid
+
+from discord_ipc import ActivityEncoder, next_nonce
+
+PID = 4242
+
+
+def activity(details, state, icon='python', language='Python', start=1700000000.0,
+             big_icon=False, button=None):
+    """An activity laid out like the plugin's `build_activity` does."""
+    if big_icon:
+        assets = {
+            'large_image': 'https://raw.githubusercontent.com/Snazzah/SublimeDiscordRP/master/icons/lang-%s.png' % icon,
+            'large_text': language,
+            'small_image': 'sublime3',
+            'small_text': 'Sublime Text v4180',
+        }
+    else:
+        assets = {
+            'small_image': 'https://raw.githubusercontent.com/Snazzah/SublimeDiscordRP/master/icons/lang-%s.png' % icon,
+            'small_text': language,
+            'large_image': 'sublime3',
+            'large_text': 'Sublime Text v4180',
+        }
+    act = {'assets': assets, 'state': state, 'details': details}
+    if start is not None:
+        act['timestamps'] = {'start': start}
+    if button is not None:
+        act['buttons'] = [{'label': 'Open Repository', 'url': button}]
+    return act
+
+
+EDITING = [
+    activity("Editing drp.py for Project SublimeDiscordRP", "Python - %.1fKB, %d lines" % (size, lines),
+             button='https://github.com/Snazzah/SublimeDiscordRP')
+    for size, lines in [(24.1, 666), (24.2, 667), (24.2, 668), (24.3, 670)]
+] + [
+    activity("Editing README.md for Project SublimeDiscordRP", "Markdown - 3.0KB, 80 lines",
+             icon='markdown', language='Markdown', button='https://github.com/Snazzah/SublimeDiscordRP'),
+    activity("Editing todo.txt", "Plain Text - 500.0B, 20 lines",
+             icon='text', language='Plain Text', start=1700000123.0),
+]
+
+CORPUS = {
+    'editing session': EDITING,
+    'big icon': [activity("Editing a.py", "Python", big_icon=True),
+                 activity("Editing a.py", "Python"),
+                 activity("Editing a.py", "Python", big_icon=True)],
+    'idle': [{'assets': {'small_image': 'afk', 'small_text': 'Idle',
+                         'large_image': 'sublime3', 'large_text': 'Sublime Text v4180'},
+              'state': 'Idle'},
+             {}],
+    'escaping': [activity('Editing "quotes" \\ back\\slash\ttab\nnewline', "\x00\x1f\x7f"),
+                 activity("Editing café.py für Prøject", "Ελληνικά - 日本語 - 🐍",
+                          language="Ünïcode")],
+    # Equal values that serialize differently must not reuse each other's JSON
+    'equal but different': [
+        activity("a", "b", start=1700000000.0),
+        activity("a", "b", start=1700000000),
+        activity("a", "b", start=1),
+        activity("a", "b", start=True),
+        activity("a", "b", start=1.0),
+        {'timestamps': {'start': 1, 'end': 2}},
+        {'timestamps': {'end': 2, 'start': 1}},
+        {'buttons': [{'label': 'a', 'url': 'b'}]},
+        {'buttons': [{'url': 'b', 'label': 'a'}]},
+        {'party': {'size': [1, 2]}},
+        {'party': {'size': [1.0, 2]}},
+        {'party': {'size': [True, 2]}},
+        {'secrets': {'join': None}},
+        {'secrets': {'join': 0}},
+        {'secrets': {'join': False}},
+    ],
+    'other values': [
+        {'instance': True, 'state': 'x', 'details': ''},
+        {'instance': False, 'state': None},
+        {'party': {'id': 'p', 'size': [2, 5]}, 'timestamps': {'start': float('inf')}},
+        {'party': {'id': 'p', 'size': [2, 5]}, 'timestamps': {'start': float('nan')}},
+        {'party': {'id': 'p', 'size': [2, 5]}, 'timestamps': {'start': float('nan')}},
+        {'timestamps': {'start': 1700000000.123456789, 'end': 10 ** 20}},
+        {'state': type('Str', (str,), {})('subclass')},
+        {1: 'non-string key', 'state': 'x'},
+        {'assets': {2: 'x', 2.5: 'y', None: 'z', True: 'w'}},
+    ],
+}
+
+
+def legacy_payload(act, nonce):
+    return json.dumps({
+        'cmd': 'SET_ACTIVITY',
+        'args': {'pid': PID,
+                 'activity': act},
+        'nonce': nonce
+    }, separators=(',', ':')).encode('utf-8')
+
+
+def check_corpus():
+    ok = True
+    for name, activities in CORPUS.items():
+        encoder = ActivityEncoder(PID)
+        # Twice, the second time from the cache
+        for i, act in enumerate(activities * 2):
+            nonce = next_nonce()
+            expected = legacy_payload(act, nonce)
+            actual = encoder.encode(act, nonce)
+            if actual != expected:
+                ok = False
+                print("FAIL %s #%d\n  expected %s\n  actual   %s" % (name, i, expected, actual))
+    print("%s: %d sequences" % ("ok" if ok else "FAILED", len(CORPUS)))
+    return ok
+
+
+def check_mutation():
+    """Values modified in place after being encoded must not be served from the cache."""
+    encoder = ActivityEncoder(PID)
+    act = activity("Editing a.py", "Python", button='https://example.com/a')
+    encoder.encode(act, '1')
+    act['assets']['small_text'] = 'Changed'
+    act['buttons'][0]['url'] = 'https://example.com/b'
+    act['timestamps']['start'] = 1.5
+    ok = encoder.encode(act, '2') == legacy_payload(act, '2')
+    print("%s: in-place modification" % ("ok" if ok else "FAILED"))
+    return ok
+
+
+_header = struct.Struct("<II")
+
+
+def frame(payload):
+    buf = bytearray(8 + len(payload))
+    _header.pack_into(buf, 0, 1, len(payload))
+    buf[8:] = payload
+    return buf
+
+
+def legacy_update(act):
+    """What the client did per activity before, from building the payload to framing it."""
+    return frame(json.dumps({
+        'cmd': 'SET_ACTIVITY',
+        'args': {'pid': os.getpid(),
+                 'activity': act},
+        'nonce': str(uuid.uuid4())
+    }, separators=(',', ':')).encode('utf-8'))
+
+
+def bench(number=20000):
+    encoder = ActivityEncoder(os.getpid())
+    updates = EDITING * 4
+    for name, func in [("json.dumps", legacy_update),
+                       ("ActivityEncoder", lambda act: frame(encoder.encode(act, next_nonce())))]:
+        timings = timeit.repeat(lambda: [func(act) for act in updates], number=number // len(updates),
+                                repeat=5)
+        print("%-16s %6.2f us/activity" % (name, min(timings) / (number // len(updates)) / len(updates)
+                                           * 1e6))
+
+
+def main():
+    ok = check_corpus()
+    ok &= check_mutation()
+    bench()
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,296 @@
+"""Correctness and speed of the git config parser.
+
+Every config of the corpus is written to a scratch repository
+and the entries found by `iter_git_config` are compared
+against `git config --list --includes`,
+and the `origin` URL against `git remote get-url origin`.
+Configs git refuses to read are checked against known answers instead.
+Then the streaming parser is timed against the previous implementation
+on large configs.
+
+Requires git. Exits with a non-zero status if any check fails.
+"""
+
+import os
+import re
+import subprocess
+import sys
+import tempfile
+import timeit
+
+from helpers import git as git_helpers
+from helpers.gitconfig import find_value, git_config_parser, iter_git_config
+
+CLONE = """\
+[core]
+\trepositoryformatversion = 0
+\tfilemode = true
+\tbare = false
+\tlogallrefupdates = true
+[remote "origin"]
+\turl = git@github.com:owner/repo.git
+\tfetch = +refs/heads/*:refs/remotes/origin/*
+[branch "main"]
+\tremote = origin
+\tmerge = refs/heads/main
+"""
+
+QUOTING = r"""
+[alias]
+	lg = log --graph --pretty=format:'%h %s'   # trailing comment
+	hello = "!echo \"hello;  world\" # not a comment"
+	tabs = "a\tb\nc"
+	spaced =    several   spaced   words   ; comment
+	mixed = "  leading" middle "trailing  "
+	hash = "#not-a-comment"
+	long = first \
+	       second \
+	"third \
+continued"
+[remote "origin"]
+	url = "/srv/git/my project.git" ; quoted path with a space
+"""
+
+SECTIONS = """\
+[Core]
+\tBare
+\tIgnoreCase = true
+[Remote "origin"] url = https://example.com/inline.git
+[remote "Upstream"]
+\turl = https://example.com/upstream.git
+[remote "with \\"quotes\\""]
+\turl = https://example.com/quotes.git
+[branch.Main]
+\tremote = origin
+"""
+
+MULTI_URL = """\
+[remote "origin"]
+\turl = https://example.com/first.git
+\turl = https://example.com/second.git
+\tpushurl = git@example.com:push.git
+"""
+
+CRLF = CLONE.replace('\n', '\r\n')
+
+INCLUDES = """\
+[core]
+\tbare = false
+[include]
+\tpath = included.inc
+[includeIf "gitdir:nowhere/"]
+\tpath = skipped.inc
+[includeIf "gitdir:**/.git"]
+\tpath = matched.inc
+[includeIf "gitdir/i:**/.GIT"]
+\tpath = matched-case.inc
+[includeIf "onbranch:main"]
+\tpath = branch.inc
+[include]
+\tpath = missing.inc
+"""
+
+INCLUDED_FILES = {
+    'included.inc': '[user]\n\tname = Included\n[include]\n\tpath = nested.inc\n',
+    'nested.inc': '[remote "origin"]\n\turl = https://example.com/from-include.git\n',
+    'skipped.inc': '[remote "origin"]\n\turl = https://example.com/skipped.git\n',
+    'matched.inc': '[user]\n\temail = matched@example.com\n',
+    'matched-case.inc': '[user]\n\tsigningkey = ABCDEF\n',
+    'branch.inc': '[user]\n\tname = On main\n',
+}
+
+
+def large_config(branches, remotes, origin_last=False):
+    parts = [CLONE.split('[remote')[0]]
+    origin = ('[remote "origin"]\n\turl = https://github.com/owner/large.git\n'
+              '\tfetch = +refs/heads/*:refs/remotes/origin/*\n')
+    if not origin_last:
+        parts.append(origin)
+    for i in range(remotes):
+        parts.append('[remote "fork%d"]\n\turl = git@github.com:user%d/large.git\n'
+                     '\tfetch = +refs/heads/*:refs/remotes/fork%d/*\n' % (i, i, i))
+    for i in range(branches):
+        parts.append('[branch "feature/topic-%d"]\n\tremote = origin\n'
+                     '\tmerge = refs/heads/feature/topic-%d\n'
+                     '\tdescription = "Work on topic %d ; see the tracker"\n' % (i, i, i))
+    if origin_last:
+        parts.append(origin)
+    return ''.join(parts)
+
+
+CORPUS = {
+    'clone': (CLONE, {}),
+    'quoting': (QUOTING, {}),
+    'sections': (SECTIONS, {}),
+    'multi-url': (MULTI_URL, {}),
+    'crlf': (CRLF, {}),
+    'includes': (INCLUDES, INCLUDED_FILES),
+    'large': (large_config(2000, 50), {}),
+    'large-origin-last': (large_config(2000, 50, origin_last=True), {}),
+}
+
+# Configs git rejects, with the URL the parser should still find
+MALFORMED = {
+    'keys-before-section': ('url = https://example.com/orphan.git\n' + CLONE,
+                            'git@github.com:owner/repo.git'),
+    'garbage-line': ('[remote "origin"]\n\t!!!\n\turl = https://example.com/ok.git\n',
+                     'https://example.com/ok.git'),
+    'unterminated-quote': ('[remote "origin"]\n\turl = "https://example.com/q.git\n',
+                           'https://example.com/q.git'),
+}
+
+
+def legacy_git_config_parser(path):
+    """The parser as it was before it streamed the file."""
+    obj = dict()
+    with open(path) as cfg:
+        lines = cfg.read().split("\n")
+        current_section = None
+
+        for line in lines:
+            line = re.sub(" |;(.*)|#(.*)", "", line)
+            if not line:
+                continue
+
+            if line.startswith("["):
+                res = re.search('"(.*)"', line)
+                if res is not None:
+                    sec_name = re.sub(r'\[|"(.*)"|\]', "", line)
+                    subsec_name = res.group(1)
+                    if sec_name not in obj:
+                        obj[sec_name] = {}
+
+                    obj[sec_name][subsec_name] = {}
+                    current_section = [sec_name, subsec_name]
+                else:
+                    sec_name = re.sub(r"\[|\]", "", line)
+                    obj[sec_name] = {}
+                    current_section = [sec_name]
+
+            else:
+                parts = re.sub("\t|\0", "", line).split("=")
+                if len(current_section) < 2:
+                    obj[current_section[0]][parts[0]] = parts[1]
+                else:
+                    obj[current_section[0]][current_section[1]][parts[0]] = parts[1]
+
+    return obj
+
+
+def run_git(repo, *args):
+    return subprocess.run(['git', '-C', repo] + list(args),
+                          stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, check=True).stdout
+
+
+def make_repo(root, name, config, extra_files):
+    repo = os.path.join(root, name)
+    subprocess.run(['git', 'init', '-q', '-b', 'main', repo], check=True)
+    git_dir = os.path.join(repo, '.git')
+    for file_name, content in extra_files.items():
+        with open(os.path.join(git_dir, file_name), 'w', newline='') as f:
+            f.write(content)
+    config_path = os.path.join(git_dir, 'config')
+    with open(config_path, 'w', newline='') as f:
+        f.write(config)
+    return repo, git_dir, config_path
+
+
+def git_entries(repo):
+    entries = []
+    for record in run_git(repo, 'config', '-z', '--local', '--includes', '--list').split(b'\0'):
+        if record:
+            key, _, value = record.decode().partition('\n')
+            entries.append((key, value if '\n' in record.decode() else None))
+    return entries
+
+
+def parsed_entries(config_path, git_dir):
+    return [('.'.join(part for part in (section, subsection, name) if part is not None), value)
+            for section, subsection, name, value in iter_git_config(config_path, git_dir)]
+
+
+def check(name, ok, detail=''):
+    print("%-4s %s%s" % ("ok" if ok else "FAIL", name, (": " + detail) if detail and not ok else ''))
+    return ok
+
+
+def check_corpus(root):
+    ok = True
+    for name, (config, extra_files) in CORPUS.items():
+        repo, git_dir, config_path = make_repo(root, name, config, extra_files)
+        expected = git_entries(repo)
+        actual = parsed_entries(config_path, git_dir)
+        ok &= check("%s: entries" % name, actual == expected,
+                    "\n  git:    %r\n  parser: %r" % (
+                        [e for e in expected if e not in actual][:5],
+                        [e for e in actual if e not in expected][:5]))
+
+        try:
+            expected_url = run_git(repo, 'remote', 'get-url', 'origin').decode().rstrip('\n')
+        except subprocess.CalledProcessError:
+            expected_url = None
+        git_helpers._config_urls.clear()
+        url = git_helpers.get_git_url_from_config(config_path)
+        ok &= check("%s: origin url" % name, url == expected_url,
+                    "%r != %r" % (url, expected_url))
+
+    for name, (config, expected_url) in MALFORMED.items():
+        _, git_dir, config_path = make_repo(root, name, config, {})
+        url = find_value(config_path, 'remote', 'origin', 'url', git_dir)
+        ok &= check("%s: origin url" % name, url == expected_url,
+                    "%r != %r" % (url, expected_url))
+
+    return ok
+
+
+def check_cache(root):
+    ok = True
+    _, _, config_path = make_repo(root, 'cache', CORPUS['includes'][0], INCLUDED_FILES)
+    git_helpers._config_urls.clear()
+    first = git_helpers.get_git_url_from_config(config_path)
+    ok &= check("cache: hit", git_helpers.get_git_url_from_config(config_path) == first)
+
+    nested = os.path.join(os.path.dirname(config_path), 'nested.inc')
+    with open(nested, 'w') as f:
+        f.write('[remote "origin"]\n\turl = https://example.com/changed-include.git\n')
+    url = git_helpers.get_git_url_from_config(config_path)
+    ok &= check("cache: included file changed", url == 'https://example.com/changed-include.git',
+                repr(url))
+
+    os.remove(nested)
+    url = git_helpers.get_git_url_from_config(config_path)
+    ok &= check("cache: included file removed", url is None, repr(url))
+    return ok
+
+
+def bench(root):
+    print()
+    for name in ('clone', 'large', 'large-origin-last'):
+        config, extra_files = CORPUS[name]
+        _, git_dir, config_path = make_repo(root, 'bench-' + name, config, extra_files)
+        number = 2000 if name == 'clone' else 20
+
+        def cached():
+            return git_helpers.get_git_url_from_config(config_path)
+
+        results = []
+        for label, func in (
+                ("legacy parser", lambda: legacy_git_config_parser(config_path)),
+                ("full parse", lambda: git_config_parser(config_path, git_dir)),
+                ("origin url", lambda: find_value(config_path, 'remote', 'origin', 'url', git_dir)),
+                ("cached", cached)):
+            seconds = min(timeit.repeat(func, number=number, repeat=3)) / number
+            results.append("%s %8.1f us" % (label, seconds * 1e6))
+        print("%-18s %6d lines: %s" % (name, config.count('\n'), ", ".join(results)))
+
+
+def main():
+    with tempfile.TemporaryDirectory() as root:
+        ok = check_corpus(root)
+        ok &= check_cache(root)
+        bench(root)
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,160 @@
+"""Checks that a lost or refused connection to Discord is noticed and recovered from.
+
+Against a fake Discord, verifies that the pipelined client answers pings,
+reports a CLOSE frame or EOF through its close callback,
+that the plugin reconnects in the background
+and sends the latest activity again without any editor event,
+and that it keeps retrying when Discord refuses the handshake.
+Exits with a non-zero status on failure.
+Requires a platform with Unix sockets.
+"""
+
+import itertools
+import logging
+import queue
+import sys
+import threading
+import time
+
+from discord_ipc import OP_FRAME, OP_HANDSHAKE, OP_PONG, DiscordIpcClient, PipelinedIpcClient
+
+from . import fake_sublime
+from .fake_discord import FakeDiscordServer
+
+CLIENT_ID = '389368374645227520'
+TIMEOUT = 1.0
+
+
+class AsyncLoop:
+
+    """Runs callbacks one at a time on a single thread, like Sublime Text's async thread."""
+
+    def __init__(self):
+        self._queue = queue.PriorityQueue()
+        self._order = itertools.count()
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def __call__(self, callback, delay=0):
+        self._queue.put((time.monotonic() + delay / 1000, next(self._order), callback))
+
+    def _run(self):
+        while True:
+            due, order, callback = self._queue.get()
+            if due > time.monotonic():
+                # Put back, something due earlier may be added meanwhile
+                self._queue.put((due, order, callback))
+                time.sleep(0.005)
+                continue
+            try:
+                callback()
+            except Exception:
+                logging.exception("error in async callback")
+
+
+def wait_for(predicate, timeout=TIMEOUT):
+    """Return the seconds it took for `predicate()` to be true, or None on timeout."""
+    started = time.monotonic()
+    while not predicate():
+        if time.monotonic() - started > timeout:
+            return None
+        time.sleep(0.001)
+    return time.monotonic() - started
+
+
+def check_ping(drp):
+    with FakeDiscordServer(record=True) as server:
+        client = PipelinedIpcClient(DiscordIpcClient.for_platform(CLIENT_ID, timeout=TIMEOUT))
+        try:
+            server.ping({'sequence': 1})
+            return wait_for(lambda: (OP_PONG, {'sequence': 1}) in server.received)
+        finally:
+            client.close()
+
+
+def check_close(drp):
+    with FakeDiscordServer() as server:
+        closed = threading.Event()
+        client = PipelinedIpcClient(DiscordIpcClient.for_platform(CLIENT_ID, timeout=TIMEOUT),
+                                    on_close=lambda client, exc: closed.set())
+        try:
+            server.drop_connections()
+            return wait_for(closed.is_set)
+        finally:
+            client.client._close()
+
+
+def check_reconnect(drp):
+    with FakeDiscordServer(record=True) as server:
+        try:
+            drp.connect(silent=True)
+            first = drp.ipc
+            activity = dict(drp.base_activity(True), details="Editing module.py")
+            drp.send_activity(activity)
+            if wait_for(lambda: not first._pending) is None:
+                return "activity was not acknowledged"
+
+            del server.received[:]
+            server.drop_connections()
+
+            def replayed():
+                frames = list(server.received)
+                return any(op == OP_HANDSHAKE for op, _ in frames) and any(
+                    op == OP_FRAME and data.get('args', {}).get('activity') == activity
+                    for op, data in frames)
+            took = wait_for(replayed)
+            if took is None:
+                return "latest activity was not sent again"
+            if wait_for(lambda: drp.ipc is not None and drp.ipc is not first) is None:
+                return "not connected again"
+            return took
+        finally:
+            drp.disconnect()
+
+
+def check_rejected(reject):
+    def check(drp):
+        with FakeDiscordServer(reject=reject):
+            started = time.monotonic()
+            try:
+                if drp.connect(silent=True):
+                    return "connected despite rejection"
+                if drp.connection_state != drp.ConnectionState.BACKING_OFF:
+                    return "no reconnection scheduled, state is %r" % drp.connection_state
+                return time.monotonic() - started
+            except Exception as e:
+                return "connect raised %r" % e
+            finally:
+                drp.disconnect()
+    check.__name__ = 'rejected_%s' % reject
+    return check
+
+
+def main():
+    logging.getLogger(fake_sublime.PACKAGE_NAME).setLevel(logging.CRITICAL)
+    logging.getLogger('discord_ipc').setLevel(logging.CRITICAL)
+    sublime = fake_sublime.install(AsyncLoop())
+    sublime.settings.update(connect_on_startup=False)
+    drp = fake_sublime.load_plugin('drp')
+    drp.plugin_loaded()
+    checks = [check_ping, check_close, check_reconnect]
+    checks += [check_rejected(reject) for reject in FakeDiscordServer.REJECTIONS]
+    failed = False
+    for check in checks:
+        result = check(drp)
+        if isinstance(result, str):
+            ok = False
+            detail = result
+        elif result is None:
+            ok = False
+            detail = "timed out after %.1fs" % TIMEOUT
+        else:
+            ok = True
+            detail = "after %.1f ms" % (result * 1000)
+        failed |= not ok
+        print("%-4s %-24s %s" % ("ok" if ok else "FAIL", check.__name__, detail))
+    drp.plugin_unloaded()
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
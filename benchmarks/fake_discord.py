@@ -0,0 +1,211 @@
+"""A local stand-in for the Discord client's IPC socket.
+
+Speaks just enough of the protocol for `discord_ipc` to connect
+and to exchange frames with it.
+"""
+
+import json
+import os
+import socket
+import struct
+import tempfile
+import threading
+import time
+
+OP_HANDSHAKE = 0
+OP_FRAME = 1
+OP_CLOSE = 2
+OP_PING = 3
+OP_PONG = 4
+
+_header = struct.Struct("<II")
+
+
+def encode_frame(op, data):
+    payload = json.dumps(data, separators=(',', ':')).encode('utf-8')
+    return _header.pack(op, len(payload)) + payload
+
+
+def _recv_exactly(conn, size):
+    buf = bytearray()
+    while len(buf) < size:
+        chunk = conn.recv(size - len(buf))
+        if not chunk:
+            raise EOFError
+        buf += chunk
+    return bytes(buf)
+
+
+class FakeDiscordServer:
+
+    """Serves the Discord IPC protocol on a Unix socket in a temporary directory.
+
+    Use as a context manager;
+    `XDG_RUNTIME_DIR` points to the socket's directory while it is active.
+
+    Frames with the `BENCH_STREAM` command make the server reply
+    with `args.count` frames carrying `args.size` bytes of padding each,
+    written with a single `sendall`.
+    The padding frames are only encoded once per count and size.
+    Frames with the `BENCH_SINK` command are not answered.
+    Every reply is delayed by `latency` seconds, which can be changed at any time.
+
+    `fault` injects misbehavior into replies to the handshake
+    or, with `fault_on='request'`, to regular frames:
+
+    * 'stall' -- never reply
+    * 'half_write' -- write half of the reply, then stall
+    * 'close_mid_frame' -- write half of the reply, then close the connection
+
+    `reject` makes the server refuse handshakes:
+
+    * 'close' -- reply with a CLOSE frame, as for an unknown client ID
+    * 'malformed_ready' -- reply with a DISPATCH frame lacking the event
+    * 'bad_json' -- reply with a frame that is not JSON
+
+    With `stale`, the server listens on `discord-ipc-1`
+    and `discord-ipc-0` accepts connections but never answers,
+    as a socket left behind by a Discord client that hangs.
+
+    `ping` and `drop_connections` act on the open connections
+    as Discord would when checking on its clients or quitting.
+    With `record`, the frames received are kept in `received` as `(op, data)`.
+    """
+
+    FAULTS = ('stall', 'half_write', 'close_mid_frame')
+    REJECTIONS = ('close', 'malformed_ready', 'bad_json')
+
+    def __init__(self, ready_padding=0, fault=None, fault_on='handshake', latency=0.0,
+                 record=False, reject=None, stale=False):
+        self.ready_padding = ready_padding
+        self.latency = latency
+        self.fault = fault
+        self.fault_on = fault_on
+        self.reject = reject
+        self.stale = stale
+        self.received = [] if record else None
+        # (count, size) -> padding frames of BENCH_STREAM replies
+        self._streams = {}
+        self._connections = set()
+        self._lock = threading.Lock()
+        self._dir = None
+        self._sock = None
+        self._stale_sock = None
+        self._thread = None
+        self._old_env = None
+
+    @property
+    def path(self):
+        return os.path.join(self._dir.name, "discord-ipc-%d" % (1 if self.stale else 0))
+
+    def __enter__(self):
+        self._dir = tempfile.TemporaryDirectory()
+        if self.stale:
+            self._stale_sock = socket.socket(socket.AF_UNIX)
+            self._stale_sock.bind(os.path.join(self._dir.name, "discord-ipc-0"))
+            self._stale_sock.listen(5)
+        self._sock = socket.socket(socket.AF_UNIX)
+        self._sock.bind(self.path)
+        self._sock.listen(5)
+        self._thread = threading.Thread(target=self._serve, daemon=True)
+        self._thread.start()
+        self._old_env = os.environ.get('XDG_RUNTIME_DIR')
+        os.environ['XDG_RUNTIME_DIR'] = self._dir.name
+        return self
+
+    def __exit__(self, *_):
+        if self._old_env is None:
+            os.environ.pop('XDG_RUNTIME_DIR', None)
+        else:
+            os.environ['XDG_RUNTIME_DIR'] = self._old_env
+        self._sock.close()
+        if self._stale_sock is not None:
+            self._stale_sock.close()
+        self._dir.cleanup()
+
+    def _serve(self):
+        while True:
+            try:
+                conn, _ = self._sock.accept()
+            except OSError:
+                return
+            threading.Thread(target=self._handle, args=(conn,), daemon=True).start()
+
+    def ping(self, data):
+        """Send a ping to every client."""
+        with self._lock:
+            for conn in self._connections:
+                conn.sendall(encode_frame(OP_PING, data))
+
+    def drop_connections(self):
+        """Close the connections to all clients, with a CLOSE frame first."""
+        with self._lock:
+            for conn in self._connections:
+                try:
+                    conn.sendall(encode_frame(OP_CLOSE, {'code': 1000, 'message': "Closing"}))
+                    conn.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+            self._connections.clear()
+
+    def _handle(self, conn):
+        with self._lock:
+            self._connections.add(conn)
+        with conn:
+            try:
+                while True:
+                    op, length = _header.unpack(_recv_exactly(conn, _header.size))
+                    data = json.loads(_recv_exactly(conn, length).decode('utf-8'))
+                    if self.received is not None:
+                        self.received.append((op, data))
+                    if op == OP_CLOSE:
+                        return
+                    reply = self.reply(op, data)
+                    if not reply:
+                        continue
+                    if self.latency:
+                        time.sleep(self.latency)
+                    if self.fault and (op == OP_HANDSHAKE) == (self.fault_on == 'handshake'):
+                        if self.fault != 'stall':
+                            conn.sendall(reply[:len(reply) // 2])
+                        if self.fault == 'close_mid_frame':
+                            return
+                        continue
+                    conn.sendall(reply)
+            except (EOFError, OSError):
+                return
+            finally:
+                with self._lock:
+                    self._connections.discard(conn)
+
+    def reply(self, op, data):
+        if op == OP_HANDSHAKE and self.reject == 'close':
+            return encode_frame(OP_CLOSE, {'code': 4000, 'message': "Invalid Client ID"})
+        elif op == OP_HANDSHAKE and self.reject == 'malformed_ready':
+            return encode_frame(OP_FRAME, {'cmd': 'DISPATCH', 'data': None, 'nonce': None})
+        elif op == OP_HANDSHAKE and self.reject == 'bad_json':
+            return _header.pack(OP_FRAME, 5) + b'{READ'
+        elif op == OP_HANDSHAKE:
+            return encode_frame(OP_FRAME, {
+                'cmd': 'DISPATCH',
+                'data': {'v': 1, 'config': {'padding': 'x' * self.ready_padding}},
+                'evt': 'READY',
+                'nonce': None,
+            })
+
+        nonce = data.get('nonce')
+        if op == OP_PONG or data.get('cmd') == 'BENCH_SINK':
+            return None
+        if data.get('cmd') == 'BENCH_STREAM':
+            key = data['args']['count'], data['args']['size']
+            stream = self._streams.get(key)
+            if stream is None:
+                frame = encode_frame(OP_FRAME, {'cmd': 'BENCH_STREAM', 'data': 'x' * key[1],
+                                                'evt': None, 'nonce': None})
+                stream = self._streams[key] = frame * key[0]
+            last = encode_frame(OP_FRAME, {'cmd': 'BENCH_STREAM', 'data': None,
+                                           'evt': None, 'nonce': nonce})
+            return stream + last
+
+        return encode_frame(OP_FRAME, {'cmd': data.get('cmd'), 'data': data.get('args'),
+                                       'evt': None, 'nonce': nonce})
@@ -0,0 +1,212 @@
+"""Stand-ins for the `sublime` and `sublime_plugin` modules.
+
+`install()` registers them in `sys.modules`,
+after which `load_plugin()` imports the package's plugins
+as if Sublime Text had loaded them.
+Views and windows are plain objects whose contents are set by the benchmarks.
+"""
+
+import importlib
+import itertools
+import os
+import sys
+import types
+
+PACKAGE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Name the package is imported as, like "Discord Rich Presence" in Sublime Text
+PACKAGE_NAME = 'discordrp_bench'
+VERSION = '4180'
+
+_ids = itertools.count(1)
+
+
+class Settings(dict):
+
+    def add_on_change(self, key, callback):
+        pass
+
+    def clear_on_change(self, key):
+        pass
+
+
+class Syntax:
+
+    def __init__(self, path, name, scope):
+        self.path = path
+        self.name = name
+        self.scope = scope
+
+
+# Syntaxes known to `syntax_from_path`
+SYNTAXES = {
+    'Packages/Python/Python.sublime-syntax': Syntax(
+        'Packages/Python/Python.sublime-syntax', 'Python', 'source.python'),
+    'Packages/JavaScript/JavaScript.sublime-syntax': Syntax(
+        'Packages/JavaScript/JavaScript.sublime-syntax', 'JavaScript', 'source.js'),
+    'Packages/Markdown/Markdown.sublime-syntax': Syntax(
+        'Packages/Markdown/Markdown.sublime-syntax', 'Markdown', 'text.html.markdown'),
+}
+
+
+class View:
+
+    """A view of a file with a given size, line count and syntax.
+
+    `size` and `lines` are reported as is, no text is kept.
+    """
+
+    def __init__(self, window, file_name, size=0, lines=1,
+                 syntax='Packages/Python/Python.sublime-syntax', scope=None):
+        self._id = next(_ids)
+        self._buffer_id = next(_ids)
+        self._window = window
+        self._file_name = file_name
+        self._size = size
+        self._lines = lines
+        self._change_count = 0
+        self._settings = Settings(syntax=syntax)
+        self._scope = scope or (SYNTAXES[syntax].scope if syntax in SYNTAXES else 'text.plain')
+        if window is not None:
+            window.views.append(self)
+
+    def id(self):
+        return self._id
+
+    def buffer_id(self):
+        return self._buffer_id
+
+    def window(self):
+        return self._window
+
+    def file_name(self):
+        return self._file_name
+
+    def settings(self):
+        return self._settings
+
+    def element(self):
+        return None
+
+    def change_count(self):
+        return self._change_count
+
+    def size(self):
+        return self._size
+
+    def rowcol(self, point):
+        # Only ever asked for the last point
+        return self._lines - 1, 0
+
+    def scope_name(self, point):
+        return self._scope + ' '
+
+    def edit(self, size_delta=1, lines_delta=0):
+        """Pretend the buffer was modified."""
+        self._size += size_delta
+        self._lines += lines_delta
+        self._change_count += 1
+
+
+class Window:
+
+    def __init__(self, folders=(), project_file_name=None):
+        self._id = next(_ids)
+        self._folders = list(folders)
+        self._project_file_name = project_file_name
+        self.views = []
+        self.active = None
+
+    def id(self):
+        return self._id
+
+    def folders(self):
+        return list(self._folders)
+
+    def set_folders(self, folders):
+        self._folders = list(folders)
+
+    def project_file_name(self):
+        return self._project_file_name
+
+    def active_view(self):
+        return self.active
+
+    def status_message(self, message):
+        pass
+
+    def create_output_panel(self, name):
+        return Panel()
+
+    def run_command(self, command, args=None):
+        pass
+
+
+class Panel:
+
+    """An output panel, keeping the text appended to it."""
+
+    def __init__(self):
+        self.text = ''
+
+    def run_command(self, command, args=None):
+        if command == 'append':
+            self.text += args['characters']
+
+
+class _Plugin:
+
+    def __init__(self, *args):
+        pass
+
+
+class _TextChangeListener(_Plugin):
+
+    @classmethod
+    def is_applicable(cls, buffer):
+        # As in Sublime Text, a subclass is not attached to any buffer unless it overrides this
+        return False
+
+
+def make_sublime(run_async=None):
+    """Create the `sublime` module.
+
+    Callbacks passed to `set_timeout_async` are handed to `run_async(callback, delay)`,
+    by default they are dropped.
+    """
+    sublime = types.ModuleType('sublime')
+    sublime.settings = Settings()
+    sublime.windows = []
+    sublime.version = lambda: VERSION
+    sublime.load_settings = lambda name: sublime.settings
+    sublime.set_timeout_async = run_async or (lambda callback, delay=0: None)
+    sublime.set_timeout = sublime.set_timeout_async
+    sublime.active_window = lambda: sublime.windows[0] if sublime.windows else Window()
+    sublime.error_message = lambda message: None
+    sublime.syntax_from_path = SYNTAXES.get
+    return sublime
+
+
+def make_sublime_plugin():
+    sublime_plugin = types.ModuleType('sublime_plugin')
+    sublime_plugin.EventListener = _Plugin
+    sublime_plugin.ApplicationCommand = _Plugin
+    sublime_plugin.WindowCommand = _Plugin
+    sublime_plugin.TextChangeListener = _TextChangeListener
+    return sublime_plugin
+
+
+def install(run_async=None):
+    """Register the fake modules and return the `sublime` one."""
+    sublime = make_sublime(run_async)
+    sys.modules['sublime'] = sublime
+    sys.modules['sublime_plugin'] = make_sublime_plugin()
+    return sublime
+
+
+def load_plugin(name='drp'):
+    """Import one of the package's top-level modules, e.g. 'drp' or '_logging'."""
+    if PACKAGE_NAME not in sys.modules:
+        package = types.ModuleType(PACKAGE_NAME)
+        package.__path__ = [PACKAGE_DIR]
+        sys.modules[PACKAGE_NAME] = package
+    return importlib.import_module('%s.%s' % (PACKAGE_NAME, name))
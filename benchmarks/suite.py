@@ -0,0 +1,323 @@
+"""Headless benchmark suite for the plugin's hot paths.
+
+Loads the plugin with the fake `sublime` module,
+connected to a fake Discord client on a Unix socket,
+and times each operation over several repeats.
+Per operation, the median and minimum time and the spread between repeats are reported,
+along with the peak and retained memory allocated, measured in a separate pass.
+
+Usage:
+
+    python -m benchmarks.suite [--quick] [--json FILE] [NAME ...]
+
+With `--json -`, only the JSON document is written to stdout,
+for comparing results between releases.
+Requires git and a platform with Unix sockets.
+"""
+
+import argparse
+import itertools
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from . import fake_sublime
+from .bench_icons import CORPUS as ICON_CORPUS
+from .fake_discord import FakeDiscordServer
+
+REPEAT = 7
+
+# (name, default number of operations per repeat, function creating the operation)
+CASES = []
+
+
+def case(name, number):
+    def register(make):
+        CASES.append((name, number, make))
+        return make
+    return register
+
+
+class Environment:
+
+    """The loaded plugin with a few windows and views over a scratch git repository."""
+
+    def __init__(self, root, server):
+        self.root = root
+        self.server = server
+        self.sublime = fake_sublime.install()
+        self.drp = fake_sublime.load_plugin('drp')
+
+        repo = os.path.join(root, 'project')
+        os.makedirs(os.path.join(repo, 'src', 'package'))
+        subprocess.run(['git', 'init', '-q', repo], check=True)
+        subprocess.run(['git', '-C', repo, 'remote', 'add', 'origin',
+                        'git@github.com:owner/project.git'], check=True)
+        other = os.path.join(root, 'notes')
+        os.makedirs(other)
+
+        self.windows = [
+            fake_sublime.Window([repo, other]),
+            fake_sublime.Window([other], os.path.join(root, 'notes.sublime-project')),
+        ]
+        self.sublime.windows = self.windows
+        main, second = self.windows
+        self.views = [
+            fake_sublime.View(main, os.path.join(repo, 'src', 'package', 'module.py'), 40000, 1200),
+            fake_sublime.View(main, os.path.join(repo, 'src', 'index.js'), 8000, 300,
+                              'Packages/JavaScript/JavaScript.sublime-syntax'),
+            fake_sublime.View(main, os.path.join(repo, 'README.md'), 3000, 80,
+                              'Packages/Markdown/Markdown.sublime-syntax'),
+            fake_sublime.View(second, os.path.join(other, 'todo.txt'), 500, 20,
+                              'Packages/Text/Plain text.tmLanguage'),
+        ]
+
+        self.sublime.settings.update(
+            connect_on_startup=False,
+            git_repository_button=True,
+            details="Editing {file} for Project {project}",
+            state="{lang} - {sizehf}, {loc} lines",
+        )
+        self.drp.plugin_loaded()
+        self.drp.connect(silent=True, retry=False)
+        if not self.drp.ipc:
+            raise RuntimeError("Could not connect to the fake Discord client")
+
+    def settle(self):
+        """Wait until queued activities were built."""
+        deadline = time.monotonic() + 5
+        while self.drp.pipeline.depth and time.monotonic() < deadline:
+            time.sleep(0.001)
+        time.sleep(0.05)
+
+    def close(self):
+        self.drp.plugin_unloaded()
+
+
+def _cycle(items):
+    return itertools.cycle(items).__next__
+
+
+@case('handle_activity', 2000)
+def bench_handle_activity(env):
+    next_view = _cycle(env.views)
+    return lambda: env.drp.handle_activity(next_view())
+
+
+@case('on_activated_cached', 5000)
+def bench_on_activated_cached(env):
+    """Switching between files whose activity was built before."""
+    for view in env.views:
+        env.drp.handle_activity(view)
+    env.settle()
+    listener = env.drp.DRPListener()
+    next_view = _cycle(env.views)
+    return lambda: listener.on_activated_async(next_view())
+
+
+@case('build_activity', 2000)
+def bench_build_activity(env):
+    drp = env.drp
+    views = [(view, view.window()) for view in env.views]
+    next_view = _cycle(views)
+
+    def run():
+        view, window = next_view()
+        syntax = drp.syntaxes.get(view.settings().get('syntax'), lambda: view.scope_name(0))
+        fields = drp.LazyFields(drp.TEMPLATE_FIELDS, view=view, window=window,
+                                entity=view.file_name(), index=drp.get_window_index(window),
+                                syntax=syntax)
+        drp.build_activity(fields, 0)
+    return run
+
+
+@case('get_icon', 20000)
+def bench_get_icon(env):
+    entries = [(file, file.rpartition('.')[2], scope) for file, scope in ICON_CORPUS]
+    next_entry = _cycle(entries)
+    return lambda: env.drp.get_icon(*next_entry())
+
+
+@case('get_project_name', 20000)
+def bench_get_project_name(env):
+    files = [(view.window(), view.file_name()) for view in env.views]
+    next_file = _cycle(files)
+
+    def run():
+        window, file = next_file()
+        env.drp.get_project_name(env.drp.get_window_index(window), file)
+    return run
+
+
+@case('get_project_name_cold', 5000)
+def bench_get_project_name_cold(env):
+    """Resolving from a freshly built window index, as after changing folders."""
+    files = [(view.window(), view.file_name()) for view in env.views]
+    next_file = _cycle(files)
+    window_index = fake_sublime.load_plugin('helpers.projects').WindowIndex
+
+    def run():
+        window, file = next_file()
+        index = window_index(window.folders(), window.project_file_name())
+        env.drp.get_project_name(index, file)
+    return run
+
+
+@case('get_git_url', 20000)
+def bench_get_git_url(env):
+    next_file = _cycle([view.file_name() for view in env.views])
+    return lambda: env.drp.get_git_url(next_file())
+
+
+@case('get_git_url_cold', 50)
+def bench_get_git_url_cold(env):
+    """Without any cached repository or URL, which spawns git."""
+    next_file = _cycle([view.file_name() for view in env.views])
+
+    def run():
+        env.drp.git_remotes.clear()
+        env.drp.get_git_url(next_file())
+    return run
+
+
+def _send_recv(env, latency):
+    discord_ipc = fake_sublime.load_plugin('discord_ipc')
+    client = discord_ipc.DiscordIpcClient.for_platform('389368374645227520')
+    env.server.latency = latency
+    nonce = itertools.count()
+    activity = {'details': 'Editing module.py', 'state': 'Python',
+                'timestamps': {'start': 1700000000}}
+
+    def run():
+        client.send_recv({'cmd': 'SET_ACTIVITY', 'args': {'pid': 1, 'activity': activity},
+                          'nonce': str(next(nonce))})
+    return run
+
+
+@case('send_recv', 5000)
+def bench_send_recv(env):
+    return _send_recv(env, 0.0)
+
+
+@case('send_recv_1ms_latency', 500)
+def bench_send_recv_latency(env):
+    return _send_recv(env, 0.001)
+
+
+@case('set_activity', 5000)
+def bench_set_activity(env):
+    """Activities differing in their state only, as while typing."""
+    discord_ipc = fake_sublime.load_plugin('discord_ipc')
+    client = discord_ipc.DiscordIpcClient.for_platform('389368374645227520')
+    lines = itertools.count()
+    activity = env.drp.base_activity(True)
+    activity.update(details='Editing module.py for Project project', timestamps={'start': 1700000000.0})
+
+    def run():
+        client.set_activity(dict(activity, state='Python - %d lines' % next(lines)))
+    return run
+
+
+def measure(run, number, repeat):
+    run()  # Warm up caches and connections
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        for _ in range(number):
+            run()
+        timings.append((time.perf_counter() - started) / number)
+    return timings
+
+
+def measure_allocations(run, number):
+    tracemalloc.start()
+    try:
+        run()
+        start, _ = tracemalloc.get_traced_memory()
+        if hasattr(tracemalloc, 'reset_peak'):
+            tracemalloc.reset_peak()
+        for _ in range(number):
+            run()
+        current, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return max(0, peak - start), (current - start) / number
+
+
+def run_case(env, name, number, make, repeat):
+    run = make(env)
+    timings = measure(run, number, repeat)
+    peak, retained = measure_allocations(run, max(1, number // 10))
+    env.server.latency = 0.0
+    median = statistics.median(timings)
+    return {
+        'name': name,
+        'number': number,
+        'repeat': repeat,
+        'median_us': median * 1e6,
+        'min_us': min(timings) * 1e6,
+        'spread': (max(timings) - min(timings)) / median if median else 0.0,
+        'peak_alloc_bytes': peak,
+        'retained_bytes_per_op': retained,
+    }
+
+
+def metadata():
+    try:
+        revision = subprocess.check_output(
+            ['git', '-C', fake_sublime.PACKAGE_DIR, 'describe', '--always', '--dirty'],
+            universal_newlines=True, stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        revision = None
+    return {
+        'revision': revision,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('names', nargs='*', help="only run these cases")
+    parser.add_argument('--quick', action='store_true', help="run a tenth of the operations")
+    parser.add_argument('--json', metavar='FILE', help="write the results as JSON, '-' for stdout")
+    args = parser.parse_args()
+
+    quiet = args.json == '-'
+    results = []
+    with tempfile.TemporaryDirectory() as root, FakeDiscordServer() as server:
+        env = Environment(root, server)
+        try:
+            for name, number, make in CASES:
+                if args.names and name not in args.names:
+                    continue
+                if args.quick:
+                    number = max(5, number // 10)
+                result = run_case(env, name, number, make, REPEAT)
+                results.append(result)
+                if not quiet:
+                    print("%-24s %10.2f us/op (min %.2f, spread %4.1f%%)"
+                          "  peak %8d B, retained %8.1f B/op"
+                          % (name, result['median_us'], result['min_us'], result['spread'] * 100,
+                             result['peak_alloc_bytes'], result['retained_bytes_per_op']))
+        finally:
+            env.close()
+
+    if args.json:
+        document = json.dumps({'meta': metadata(), 'results': results}, indent=2)
+        if quiet:
+            sys.stdout.write(document + '\n')
+        else:
+            with open(args.json, 'w') as f:
+                f.write(document + '\n')
+
+
+if __name__ == '__main__':
+    main()
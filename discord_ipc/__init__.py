@@ -6,13 +6,75 @@
 # * https://github.com/devsnek/discord-rpc/tree/master/example/main.js
 
 from abc import ABCMeta, abstractmethod
+from concurrent.futures import Future
+from functools import partial
+import errno
+import itertools
 import json
+from json.encoder import encode_basestring_ascii
 import logging
 import os
+import select
 import socket
 import sys
 import struct
-import uuid
+import threading
+import time
+
+if sys.platform == 'win32':
+    import ctypes
+    from ctypes import wintypes
+
+    GENERIC_READ = 0x80000000
+    GENERIC_WRITE = 0x40000000
+    OPEN_EXISTING = 3
+    FILE_FLAG_OVERLAPPED = 0x40000000
+    INVALID_HANDLE_VALUE = wintypes.HANDLE(-1).value
+    INFINITE = 0xFFFFFFFF
+    WAIT_OBJECT_0 = 0
+    WAIT_FAILED = 0xFFFFFFFF
+    ERROR_MORE_DATA = 234
+    ERROR_OPERATION_ABORTED = 995
+    ERROR_IO_PENDING = 997
+
+    class _Overlapped(ctypes.Structure):
+        _fields_ = [
+            ('Internal', ctypes.c_void_p),
+            ('InternalHigh', ctypes.c_void_p),
+            ('Offset', wintypes.DWORD),
+            ('OffsetHigh', wintypes.DWORD),
+            ('hEvent', wintypes.HANDLE),
+        ]
+
+    _kernel32 = ctypes.WinDLL('kernel32', use_last_error=True)
+    for _name, _restype, _argtypes in [
+        ('CreateFileW', wintypes.HANDLE, (wintypes.LPCWSTR, wintypes.DWORD, wintypes.DWORD, wintypes.LPVOID,
+                                          wintypes.DWORD, wintypes.DWORD, wintypes.HANDLE)),
+        ('CreateEventW', wintypes.HANDLE, (wintypes.LPVOID, wintypes.BOOL, wintypes.BOOL, wintypes.LPCWSTR)),
+        ('ReadFile', wintypes.BOOL, (wintypes.HANDLE, wintypes.LPVOID, wintypes.DWORD, wintypes.LPDWORD,
+                                     ctypes.POINTER(_Overlapped))),
+        ('WriteFile', wintypes.BOOL, (wintypes.HANDLE, wintypes.LPVOID, wintypes.DWORD, wintypes.LPDWORD,
+                                      ctypes.POINTER(_Overlapped))),
+        ('GetOverlappedResult', wintypes.BOOL, (wintypes.HANDLE, ctypes.POINTER(_Overlapped),
+                                                wintypes.LPDWORD, wintypes.BOOL)),
+        ('CancelIoEx', wintypes.BOOL, (wintypes.HANDLE, ctypes.POINTER(_Overlapped))),
+        ('WaitForMultipleObjects', wintypes.DWORD, (wintypes.DWORD, ctypes.POINTER(wintypes.HANDLE),
+                                                    wintypes.BOOL, wintypes.DWORD)),
+        ('SetEvent', wintypes.BOOL, (wintypes.HANDLE,)),
+        ('CloseHandle', wintypes.BOOL, (wintypes.HANDLE,)),
+    ]:
+        getattr(_kernel32, _name).restype = _restype
+        getattr(_kernel32, _name).argtypes = _argtypes
+
+    def _create_event():
+        """Create an auto-reset event."""
+        handle = _kernel32.CreateEventW(None, False, False, None)
+        if not handle:
+            raise ctypes.WinError(ctypes.get_last_error())
+        return handle
+
+    def _wait_milliseconds(timeout):
+        return INFINITE if timeout is None else min(int(timeout * 1000) + 1, INFINITE - 1)
 
 
 OP_HANDSHAKE = 0
@@ -21,13 +83,194 @@ OP_CLOSE = 2
 OP_PING = 3
 OP_PONG = 4
 
+# File name prefix of the IPC sockets, followed by a number
+ENDPOINT_PREFIX = "discord-ipc-"
+
+# Time to wait for a single endpoint candidate to accept a connection
+PROBE_TIMEOUT = 0.5
+
+HEADER_SIZE = 8
+RECV_BUFFER_SIZE = 64 * 1024
+
+_header = struct.Struct("<II")
+
 logger = logging.getLogger(__name__)
+# Marks log records dumping whole payloads, which may be rate limited
+PAYLOAD_DUMP = {'payload_dump': True}
+
+# Nonces only need to be unique among the requests of this process
+_nonces = itertools.count(1)
+# Same output as json.dumps(obj, separators=(',', ':'))
+_json_encode = json.JSONEncoder(separators=(',', ':')).encode
+_SCALAR_TYPES = frozenset({str, int, float, bool, type(None)})
 
 
 class DiscordIpcError(Exception):
     pass
 
 
+class DiscordIpcTimeout(DiscordIpcError, TimeoutError):
+    """An operation did not complete before its deadline."""
+    pass
+
+
+class DiscordIpcProtocolError(DiscordIpcError):
+    """Discord rejected the handshake or sent a frame that could not be understood."""
+    pass
+
+
+class Deadline:
+
+    """Point in time by which a blocking operation must have completed.
+
+    A timeout of None means the operation may block indefinitely.
+    With `within`, the deadline passes no later than that enclosing one.
+    """
+
+    __slots__ = ('operation', 'timeout', 'expires_at', 'within')
+
+    def __init__(self, timeout, operation="operation", within=None):
+        self.operation = operation
+        self.timeout = timeout
+        self.within = within
+        self.restart()
+
+    def restart(self):
+        """Count the timeout from now again."""
+        self.expires_at = None if self.timeout is None else time.monotonic() + self.timeout
+        within = self.within
+        if within is not None and within.expires_at is not None and (
+                self.expires_at is None or within.expires_at < self.expires_at):
+            self.expires_at = within.expires_at
+
+    def remaining(self):
+        """Return the seconds left, or None without a deadline.
+
+        Raises DiscordIpcTimeout once the deadline has passed.
+        """
+        if self.expires_at is None:
+            return None
+        remaining = self.expires_at - time.monotonic()
+        if remaining <= 0:
+            raise self.timeout_error()
+        return remaining
+
+    def expired(self):
+        return self.expires_at is not None and time.monotonic() >= self.expires_at
+
+    def timeout_error(self):
+        if self.within is not None and self.expires_at == self.within.expires_at:
+            return self.within.timeout_error()
+        return DiscordIpcTimeout("%s timed out after %.1f seconds" % (self.operation, self.timeout))
+
+
+NO_DEADLINE = Deadline(None)
+
+
+def _fingerprint(obj):
+    """Build a hashable, key order independent representation of a JSON-like object."""
+    if isinstance(obj, dict):
+        return frozenset((key, _fingerprint(value)) for key, value in obj.items())
+    elif isinstance(obj, list):
+        return tuple(_fingerprint(item) for item in obj)
+    return obj
+
+
+def _is_acknowledged(reply):
+    op, data = reply
+    return op == OP_FRAME and data.get('evt') != 'ERROR'
+
+
+def next_nonce():
+    return str(next(_nonces))
+
+
+def _is_flat(value):
+    """Whether `value` is a scalar, a dict of scalars with string keys, or a list of such dicts."""
+    if type(value) is dict:
+        return all(type(key) is str and type(item) in _SCALAR_TYPES for key, item in value.items())
+    elif type(value) is list:
+        return all(type(item) is dict and _is_flat(item) for item in value)
+    return type(value) in _SCALAR_TYPES
+
+
+def _shape(value):
+    """Key order and value types of a flat value, see `_is_flat`.
+
+    Equal flat values of the same shape serialize to the same JSON,
+    which is not true of equal values in general, as 1 == 1.0 == True
+    and dicts compare equal regardless of key order.
+    """
+    if type(value) is dict:
+        return tuple(value), tuple(map(type, value.values()))
+    elif type(value) is list:
+        return tuple(map(_shape, value))
+    return type(value)
+
+
+def _copy_flat(value):
+    if type(value) is dict:
+        return dict(value)
+    elif type(value) is list:
+        return [dict(item) for item in value]
+    return value
+
+
+class ActivityEncoder:
+
+    """Serialize SET_ACTIVITY payloads, reusing the JSON of the parts that did not change.
+
+    The payload around the activity, including the pid, is serialized once,
+    and so is every key of the activity.
+    Flat values, such as the assets, timestamps and buttons,
+    are only serialized again when they differ from the last value of the same key.
+    Strings are escaped directly and anything else is left to `json`.
+    The result is identical to `json.dumps(payload, separators=(',', ':'))`.
+    """
+
+    def __init__(self, pid):
+        self._head = '{"cmd":"SET_ACTIVITY","args":{"pid":%d,"activity":' % pid
+        self._pid = pid
+        # Key -> its JSON followed by a colon
+        self._keys = {}
+        # Key -> (copy of the last flat value, its shape, its JSON)
+        self._values = {}
+
+    def encode(self, act, nonce):
+        """Return the payload setting `act` as bytes."""
+        keys = self._keys
+        values = self._values
+        parts = [self._head]
+        separator = '{'
+        for key, value in act.items():
+            key_json = keys.get(key)
+            if key_json is None:
+                if type(key) is not str:
+                    return self._encode_payload(act, nonce)
+                key_json = keys[key] = encode_basestring_ascii(key) + ':'
+
+            if type(value) is str:
+                value_json = encode_basestring_ascii(value)
+            else:
+                cached = values.get(key)
+                if cached is not None and cached[0] == value and cached[1] == _shape(value):
+                    value_json = cached[2]
+                else:
+                    value_json = _json_encode(value)
+                    if _is_flat(value):
+                        values[key] = (_copy_flat(value), _shape(value), value_json)
+            parts += (separator, key_json, value_json)
+            separator = ','
+
+        parts.append('}' if act else '{}')
+        parts += ('},"nonce":', encode_basestring_ascii(nonce), '}')
+        return ''.join(parts).encode('ascii')
+
+    def _encode_payload(self, act, nonce):
+        payload = {'cmd': 'SET_ACTIVITY', 'args': {'pid': self._pid, 'activity': act}, 'nonce': nonce}
+        return _json_encode(payload).encode('ascii')
+
+
 class DiscordIpcClient(metaclass=ABCMeta):
 
     """Work with an open Discord instance via its JSON IPC for its rich presence API.
@@ -39,58 +282,210 @@ class DiscordIpcClient(metaclass=ABCMeta):
     Supports context handler protocol.
     """
 
-    def __init__(self, client_id):
+    # Endpoint of the last successful handshake, tried first when connecting again
+    _last_endpoint = None
+
+    def __init__(self, client_id, activity=None, *,
+                 connect_timeout=None, handshake_timeout=None, connection_timeout=None,
+                 timeout=None):
         self.client_id = client_id
-        self._connect()
-        self._do_handshake()
+        # Default timeout of requests, in seconds
+        self.timeout = timeout
+        self._reset_buffer()
+        # Fingerprint of the last activity acknowledged by Discord
+        self._last_activity = None
+        self.skipped_activities = 0
+        self._encoder = ActivityEncoder(os.getpid())
+        # Limits connecting and the handshake together
+        total = Deadline(connection_timeout, "connection")
+        started = time.perf_counter()
+        try:
+            connected = self._connect(activity, Deadline(connect_timeout, "connect", total),
+                                      handshake_timeout, total)
+        except Exception:
+            type(self)._last_endpoint = None
+            raise
+        self.connect_duration = connected - started
+        self.handshake_duration = time.perf_counter() - connected
+        reused = self.path == self._last_endpoint
+        type(self)._last_endpoint = self.path
         logger.info("connected via ID %s", client_id)
+        logger.debug("connected to %r in %.1f ms (%s), handshake took %.1f ms",
+                     self.path, self.connect_duration * 1000,
+                     "last endpoint" if reused else "discovered",
+                     self.handshake_duration * 1000)
 
     @classmethod
-    def for_platform(cls, client_id, platform=sys.platform):
+    def for_platform(cls, client_id, platform=sys.platform, activity=None, **kwargs):
+        return cls.class_for_platform(platform)(client_id, activity, **kwargs)
+
+    @staticmethod
+    def class_for_platform(platform=sys.platform):
         if platform == 'win32':
-            return WinDiscordIpcClient(client_id)
+            return WinDiscordIpcClient
         else:
-            return UnixDiscordIpcClient(client_id)
+            return UnixDiscordIpcClient
+
+    def _reset_buffer(self):
+        # Receive buffer; bytes between _rstart and _rend have not been parsed yet.
+        self._rbuf = bytearray(RECV_BUFFER_SIZE)
+        self._rstart = self._rend = 0
+        # Size of the frame waiting to be completed
+        self._rneeded = 0
+
+    def _connect(self, activity, connect_deadline, handshake_timeout, total):
+        """Connect to the endpoints in turn until a handshake succeeds.
+
+        An endpoint left behind by a Discord client that is gone may still accept connections
+        but never complete the handshake,
+        so the next endpoint is tried then, as long as the total deadline allows.
+        The connect deadline starts over for each endpoint after the first.
+        Returns when the successful connection was established, from `time.perf_counter`.
+        """
+        error = None
+        connections = self._iter_connections(connect_deadline)
+        try:
+            while not total.expired():
+                try:
+                    next(connections)
+                except StopIteration:
+                    break
+                except DiscordIpcTimeout:
+                    if error is None:
+                        raise
+                    break
+                connected = time.perf_counter()
+                try:
+                    self._do_handshake(activity, Deadline(handshake_timeout, "handshake", total))
+                except (OSError, DiscordIpcError) as e:
+                    logger.debug("handshake with %r failed: %s", self.path, e)
+                    self._close()
+                    self._reset_buffer()
+                    connect_deadline.restart()
+                    error = e
+                except Exception:
+                    self._close()
+                    raise
+                else:
+                    return connected
+        finally:
+            connections.close()
+        if error is not None:
+            raise error
+        total.remaining()
+        raise DiscordIpcError("Failed to connect to Discord")
+
+    @abstractmethod
+    def _iter_connections(self, deadline: Deadline):
+        """Connect to each endpoint that accepts, in order of preference.
+
+        Sets the connection up and yields once connected, before trying the next endpoint.
+        Raises DiscordIpcTimeout if the deadline passes while waiting for an endpoint.
+        """
+        pass
 
+    @staticmethod
     @abstractmethod
-    def _connect(self):
+    def endpoint_dirs():
+        """Directories that may contain Discord's IPC endpoints."""
         pass
 
-    def _do_handshake(self):
-        ret_op, ret_data = self.send_recv({'v': 1, 'client_id': self.client_id}, op=OP_HANDSHAKE)
+    def _do_handshake(self, activity=None, deadline=NO_DEADLINE):
+        """Perform the handshake, optionally setting an initial activity.
+
+        The activity is sent in the same write as the handshake
+        to save a round trip.
+        """
+        handshake = {'v': 1, 'client_id': self.client_id}
+        frames = [(OP_HANDSHAKE, handshake)]
+        if activity is not None:
+            nonce, payload = self._set_activity_payload(activity)
+            frames.append((OP_FRAME, payload))
+
+        self.send_many(frames, deadline=deadline)
+        ret_op, ret_data = self._recv_reply(None, deadline)
         # {'cmd': 'DISPATCH', 'data': {'v': 1, 'config': {...}}, 'evt': 'READY', 'nonce': None}
-        if ret_op == OP_FRAME and ret_data['cmd'] == 'DISPATCH' and ret_data['evt'] == 'READY':
-            return
-        else:
-            if ret_op == OP_CLOSE:
-                self.close()
-            raise RuntimeError(ret_data)
+        if ret_op == OP_CLOSE:
+            raise DiscordIpcProtocolError("handshake rejected: %s" % (ret_data,))
+        if not (ret_op == OP_FRAME and ret_data.get('cmd') == 'DISPATCH'
+                and ret_data.get('evt') == 'READY'):
+            raise DiscordIpcProtocolError("unexpected reply to handshake: %s" % (ret_data,))
+
+        if activity is not None:
+            reply = self._recv_reply(nonce, deadline)
+            self._acknowledge_activity(reply, _fingerprint(activity))
 
     @abstractmethod
-    def _write(self, date: bytes):
+    def _write(self, data: bytes, deadline: Deadline):
+        """Write all of `data` at once."""
         pass
 
     @abstractmethod
-    def _recv(self, size: int) -> bytes:
+    def _recv_into(self, buffer: memoryview, deadline: Deadline) -> int:
+        """Read at most `len(buffer)` bytes into `buffer` with a single read call.
+
+        Waits until data is available or the deadline has passed.
+        Returns the number of bytes read, 0 at EOF.
+        """
         pass
 
-    def _recv_header(self) -> (int, int):
-        header = self._recv_exactly(8)
-        return struct.unpack("<II", header)
+    def wakeup(self):
+        """Make a read waiting for data check its deadline again, as it may have been moved."""
+        pass
 
-    def _recv_exactly(self, size) -> bytes:
-        buf = b""
-        size_remaining = size
-        while size_remaining:
-            chunk = self._recv(size_remaining)
-            buf += chunk
-            size_remaining -= len(chunk)
-        return buf
+    def _next_frame(self):
+        """Parse one complete frame from the receive buffer, if available.
+
+        Returns the op code and the payload offsets within the buffer,
+        or None if more data needs to be read first.
+        """
+        available = self._rend - self._rstart
+        if available < HEADER_SIZE:
+            return None
+        op, length = _header.unpack_from(self._rbuf, self._rstart)
+        if available < HEADER_SIZE + length:
+            self._rneeded = HEADER_SIZE + length
+            return None
+        start = self._rstart + HEADER_SIZE
+        self._rstart = start + length
+        return op, start, self._rstart
+
+    def _fill(self, deadline):
+        """Read as much as is currently available into the receive buffer.
+
+        A frame that does not fit behind the data in the buffer
+        is read into a buffer of its own size,
+        so only the part already received is copied and reads stop at the end of the frame.
+        All state is kept on the client, so reading can resume after a timeout.
+        """
+        if self._rstart == self._rend:
+            self._rstart = self._rend = 0
+            if len(self._rbuf) != RECV_BUFFER_SIZE:
+                # Done with a frame that had its own buffer
+                self._rbuf = bytearray(RECV_BUFFER_SIZE)
+        elif self._rstart + max(self._rneeded, HEADER_SIZE) > len(self._rbuf):
+            pending = self._rend - self._rstart
+            with memoryview(self._rbuf) as view, view[self._rstart:self._rend] as partial:
+                if self._rneeded:
+                    buf = bytearray(self._rneeded)
+                    buf[:pending] = partial
+                    self._rbuf = buf
+                else:
+                    # Move the partial header to the front
+                    self._rbuf[:pending] = partial
+            self._rstart, self._rend = 0, pending
+
+        with memoryview(self._rbuf) as view, view[self._rend:] as free:
+            size = self._recv_into(free, deadline)
+        if not size:
+            raise ConnectionResetError("connection closed by Discord")
+        self._rend += size
+        self._rneeded = 0
 
     def close(self):
         logger.warning("closing connection")
         try:
-            self.send({}, op=OP_CLOSE)
+            self.send({}, op=OP_CLOSE, deadline=Deadline(self.timeout, "close"))
         finally:
             self._close()
 
@@ -104,108 +499,511 @@ class DiscordIpcClient(metaclass=ABCMeta):
     def __exit__(self, *_):
         self.close()
 
-    def send_recv(self, data, *, op=OP_FRAME):
-        nonce = data.get('nonce')
-        self.send(data, op=op)
+    def send_recv(self, data, *, op=OP_FRAME, timeout=None):
+        """Send a frame and wait for the reply with the same nonce.
+
+        Raises DiscordIpcTimeout if that takes longer than `timeout` seconds,
+        which defaults to the client's timeout.
+        """
+        deadline = Deadline(self.timeout if timeout is None else timeout, "request")
+        self.send(data, op=op, deadline=deadline)
+        return self._recv_reply(data.get('nonce'), deadline)
+
+    def _recv_reply(self, nonce, deadline=NO_DEADLINE):
         while True:
-            # TODO timeout
-            reply = self.recv()
-            if reply[1].get('nonce') == nonce:
+            reply = self.recv(deadline)
+            if reply[0] == OP_PING:
+                self.send(reply[1], op=OP_PONG, deadline=deadline)
+            elif reply[0] == OP_PONG:
+                pass
+            elif reply[1].get('nonce') == nonce:
                 return reply
             else:
                 logger.warning("received unexpected reply; %s", reply)
-        return
 
-    def send(self, data, *, op=OP_FRAME):
-        logger.debug("sending %s", data)
-        data_str = json.dumps(data, separators=(',', ':'))
-        data_bytes = data_str.encode('utf-8')
-        header = struct.pack("<II", op, len(data_bytes))
-        self._write(header)
-        self._write(data_bytes)
+    def send(self, data, *, op=OP_FRAME, deadline=NO_DEADLINE):
+        self.send_many([(op, data)], deadline=deadline)
 
-    def recv(self) -> (int, "JSON"):
+    def send_many(self, frames, *, deadline=NO_DEADLINE):
+        """Send several `(op, data)` frames with a single write.
+
+        `data` is serialized to JSON, unless it already is bytes.
+        """
+        encoded = []
+        for op, data in frames:
+            if not isinstance(data, bytes):
+                logger.debug("sending %s", data, extra=PAYLOAD_DUMP)
+                data = json.dumps(data, separators=(',', ':')).encode('utf-8')
+            encoded.append((op, data))
+
+        buf = bytearray(sum(HEADER_SIZE + len(data_bytes) for _, data_bytes in encoded))
+        offset = 0
+        for op, data_bytes in encoded:
+            _header.pack_into(buf, offset, op, len(data_bytes))
+            offset += HEADER_SIZE
+            buf[offset:offset + len(data_bytes)] = data_bytes
+            offset += len(data_bytes)
+        self._write(buf, deadline)
+
+    def recv(self, deadline=NO_DEADLINE) -> (int, "JSON"):
         """Receives a packet from discord.
 
         Returns op code and payload.
         """
-        op, length = self._recv_header()
-        payload = self._recv_exactly(length)
-        data = json.loads(payload.decode('utf-8'))
-        logger.debug("received %s", data)
+        frame = self._next_frame()
+        while frame is None:
+            self._fill(deadline)
+            frame = self._next_frame()
+
+        op, start, end = frame
+        with memoryview(self._rbuf) as view, view[start:end] as payload:
+            try:
+                data = json.loads(str(payload, 'utf-8'))
+            except ValueError as e:
+                raise DiscordIpcProtocolError("malformed frame: %s" % e) from e
+        if not isinstance(data, dict):
+            raise DiscordIpcProtocolError("malformed frame: %r" % (data,))
+        logger.debug("received %s", data, extra=PAYLOAD_DUMP)
         return op, data
 
     def set_activity(self, act):
-        data = {
-            'cmd': 'SET_ACTIVITY',
-            'args': {'pid': os.getpid(),
-                     'activity': act},
-            'nonce': str(uuid.uuid4())
-        }
-        return self.send_recv(data)
+        """Set the rich presence activity.
+
+        Returns None without sending anything
+        if the activity is identical to the last one Discord acknowledged.
+        """
+        fingerprint = self._check_activity(act)
+        if fingerprint is None:
+            return None
+
+        nonce, payload = self._set_activity_payload(act)
+        deadline = Deadline(self.timeout, "request")
+        self.send(payload, deadline=deadline)
+        reply = self._recv_reply(nonce, deadline)
+        self._acknowledge_activity(reply, fingerprint)
+        return reply
+
+    def _check_activity(self, act):
+        """Return the fingerprint of `act`, or None if it was already acknowledged."""
+        fingerprint = _fingerprint(act)
+        if fingerprint == self._last_activity:
+            self.skipped_activities += 1
+            logger.debug("activity unchanged, not sending (%d skipped)", self.skipped_activities)
+            return None
+        return fingerprint
+
+    def _acknowledge_activity(self, reply, fingerprint):
+        if _is_acknowledged(reply):
+            self._last_activity = fingerprint
+
+    def _set_activity_payload(self, act):
+        """Return a new nonce and the serialized payload setting `act`."""
+        nonce = next_nonce()
+        logger.debug("sending activity %s with nonce %s", act, nonce, extra=PAYLOAD_DUMP)
+        return nonce, self._encoder.encode(act, nonce)
 
     def clear_activity(self):
-        data = {
+        self._last_activity = None
+        return self.send_recv(self._clear_activity_payload())
+
+    @staticmethod
+    def _clear_activity_payload():
+        return {
             'cmd': 'SET_ACTIVITY',
             'args': {'pid': os.getpid()},
-            'nonce': str(uuid.uuid4())
+            'nonce': next_nonce()
         }
-        return self.send_recv(data)
+
+
+class PipelinedIpcClient:
+
+    """Work with a connected DiscordIpcClient without blocking on replies.
+
+    A dedicated reader thread receives all frames
+    and resolves the `concurrent.futures.Future` of the request with the matching nonce,
+    so several requests can be outstanding at once.
+    Frames without a nonce, such as DISPATCH events,
+    are passed to the callbacks registered with `subscribe`.
+    Requests are timed out by the same thread,
+    which waits for frames until the earliest deadline of the outstanding requests.
+    Pings from Discord are answered right away,
+    and once Discord closes the connection or it breaks,
+    `on_close(pipelined_client, exc)` is called unless `close` was called first.
+    All of these callbacks are run on the reader thread.
+
+    The wrapped client must not be used directly anymore.
+    """
+
+    def __init__(self, client, on_close=None):
+        self.client = client
+        self.on_close = on_close
+        self.error = None
+        # nonce -> (future, deadline)
+        self._pending = {}
+        # Earliest deadline of the pending requests, moved as they come and go
+        self._sweep = Deadline(None, "request")
+        self._subscribers = {}
+        self._lock = threading.Lock()
+        self._closing = False
+        self._reader = threading.Thread(target=self._read_loop, name="discord-ipc-reader", daemon=True)
+        self._reader.start()
+
+    def request(self, data, *, timeout=None):
+        """Send a frame and return a future for the reply with the same nonce.
+
+        If no reply arrives within `timeout` seconds,
+        the future fails with DiscordIpcTimeout.
+        """
+        return self._request(data['nonce'], data, timeout)
+
+    def _request(self, nonce, data, timeout):
+        future = Future()
+        deadline = Deadline(timeout, "request")
+        with self._lock:
+            if self.error is not None:
+                future.set_exception(self.error)
+                return future
+            self._pending[nonce] = (future, deadline)
+            try:
+                self.client.send(data, deadline=deadline)
+            except OSError as e:
+                del self._pending[nonce]
+                future.set_exception(e)
+                return future
+            expires_at = self._sweep.expires_at
+            if deadline.expires_at is not None and (expires_at is None
+                                                    or deadline.expires_at < expires_at):
+                self._sweep.expires_at = deadline.expires_at
+                self._sweep.timeout = timeout
+                self.client.wakeup()
+        return future
+
+    def subscribe(self, evt, callback):
+        """Call `callback(data)` for every DISPATCH frame of the given event."""
+        self._subscribers.setdefault(evt, []).append(callback)
+
+    def set_activity(self, act, *, timeout=None):
+        """Set the rich presence activity.
+
+        The returned future resolves to None right away
+        if the activity is identical to the last one sent,
+        unless Discord did not acknowledge that one.
+        Comparing to the last acknowledged activity instead
+        would skip going back to it while another request is still pending.
+        """
+        with self._lock:
+            fingerprint = self.client._check_activity(act)
+            if fingerprint is not None:
+                self.client._last_activity = fingerprint
+        if fingerprint is None:
+            future = Future()
+            future.set_result(None)
+            return future
+
+        nonce, payload = self.client._set_activity_payload(act)
+        future = self._request(nonce, payload, timeout)
+        future.add_done_callback(partial(self._on_activity_reply, fingerprint))
+        return future
+
+    def clear_activity(self, *, timeout=None):
+        with self._lock:
+            self.client._last_activity = None
+        return self.request(self.client._clear_activity_payload(), timeout=timeout)
+
+    def close(self):
+        self._closing = True
+        with self._lock:
+            self.client.close()
+
+    def _on_activity_reply(self, fingerprint, future):
+        if future.cancelled() or future.exception() is not None or not _is_acknowledged(future.result()):
+            with self._lock:
+                # Unless another activity was sent since, the same one must not be skipped
+                if self.client._last_activity == fingerprint:
+                    self.client._last_activity = None
+
+    def _move_sweep(self):
+        """Move the sweep to the earliest deadline of the pending requests, under the lock."""
+        deadlines = [deadline for _, deadline in self._pending.values()
+                     if deadline.expires_at is not None]
+        # No default argument to min, as Sublime Text 3 runs Python 3.3
+        earliest = min(deadlines, key=lambda deadline: deadline.expires_at) if deadlines else NO_DEADLINE
+        self._sweep.expires_at = earliest.expires_at
+        self._sweep.timeout = earliest.timeout
+
+    def _expire(self):
+        now = time.monotonic()
+        with self._lock:
+            expired = [(nonce, future) for nonce, (future, deadline) in self._pending.items()
+                       if deadline.expires_at is not None and deadline.expires_at <= now]
+            for nonce, _ in expired:
+                del self._pending[nonce]
+            self._move_sweep()
+        for nonce, future in expired:
+            if not future.done():
+                future.set_exception(DiscordIpcTimeout("no reply from Discord for nonce %s" % nonce))
+
+    def _read_loop(self):
+        try:
+            while True:
+                try:
+                    op, data = self.client.recv(self._sweep)
+                except DiscordIpcTimeout:
+                    # Reading resumes where it stopped
+                    self._expire()
+                    continue
+                if op == OP_PING:
+                    self._pong(data)
+                    continue
+                elif op == OP_PONG:
+                    continue
+                elif op == OP_CLOSE:
+                    raise ConnectionResetError("connection closed by Discord: %s" % data)
+
+                nonce = data.get('nonce')
+                if nonce is None:
+                    self._dispatch(data)
+                    continue
+
+                with self._lock:
+                    future, deadline = self._pending.pop(nonce, (None, None))
+                    if deadline is not None and deadline.expires_at == self._sweep.expires_at:
+                        self._move_sweep()
+                if future is None:
+                    logger.warning("received unexpected reply; %s", (op, data))
+                elif not future.done():
+                    future.set_result((op, data))
+        except Exception as e:
+            if not self._closing:
+                logger.error("reader stopped: %s", e)
+            self._fail_pending(e)
+            if not self._closing and self.on_close is not None:
+                try:
+                    self.on_close(self, self.error)
+                except Exception:
+                    logger.exception("error in close callback")
+
+    def _pong(self, data):
+        logger.debug("answering ping %s", data)
+        with self._lock:
+            self.client.send(data, op=OP_PONG, deadline=Deadline(self.client.timeout, "pong"))
+
+    def _dispatch(self, data):
+        for callback in self._subscribers.get(data.get('evt'), ()):
+            try:
+                callback(data)
+            except Exception:
+                logger.exception("error in subscriber for %s", data.get('evt'))
+
+    def _fail_pending(self, exc):
+        if not isinstance(exc, OSError):
+            exc = ConnectionError(exc)
+        with self._lock:
+            self.error = exc
+            pending = [future for future, _ in self._pending.values()]
+            self._pending.clear()
+        for future in pending:
+            if not future.done():
+                future.set_exception(exc)
 
 
 class WinDiscordIpcClient(DiscordIpcClient):
 
     _pipe_pattern = R'\\?\pipe\discord-ipc-{}'
+    _handle = None
 
-    def _connect(self):
-        for i in range(10):
-            path = self._pipe_pattern.format(i)
+    @staticmethod
+    def endpoint_dirs():
+        # Named pipes do not live in a directory that can be watched
+        return []
+
+    def _iter_connections(self, deadline):
+        paths = [self._pipe_pattern.format(i) for i in range(10)]
+        if self._last_endpoint in paths:
+            paths.remove(self._last_endpoint)
+            paths.insert(0, self._last_endpoint)
+
+        for path in paths:
+            # Opening does not wait for a busy pipe, so the deadline is only checked in between
+            deadline.remaining()
             logger.debug("Attempting to open %r", path)
-            try:
-                self._f = open(path, "w+b")
-            except OSError as e:
-                logger.error("failed to open %r: %s", path, e)
-            else:
-                break
-        else:
-            raise DiscordIpcError("Failed to connect to Discord pipe")
+            # I/O on a synchronous pipe handle is serialized,
+            # so a blocking read would stall writes from other threads until data arrives.
+            # Overlapped I/O lets reads wait on an event instead.
+            handle = _kernel32.CreateFileW(path, GENERIC_READ | GENERIC_WRITE, 0, None,
+                                           OPEN_EXISTING, FILE_FLAG_OVERLAPPED, None)
+            if handle == INVALID_HANDLE_VALUE:
+                logger.error("failed to open %r: %s", path, ctypes.WinError(ctypes.get_last_error()))
+                continue
+            self._handle = handle
+            self.path = path
+            self._read_event = _create_event()
+            self._write_event = _create_event()
+            self._wakeup_event = _create_event()
+            yield
 
-        self.path = path
+    def _write(self, data: bytes, deadline):
+        # Writes only block if Discord stopped reading and the pipe buffer is full
+        if isinstance(data, bytes):
+            data = bytearray(data)
+        with memoryview(data) as view:
+            written = 0
+            while written < len(view):
+                with view[written:] as rest:
+                    written += self._transfer(_kernel32.WriteFile, rest, (self._write_event,),
+                                              deadline)
 
-    def _write(self, data: bytes):
-        self._f.write(data)
-        self._f.flush()
+    def _recv_into(self, buffer: memoryview, deadline) -> int:
+        try:
+            return self._transfer(_kernel32.ReadFile, buffer, (self._read_event, self._wakeup_event),
+                                  deadline)
+        except BrokenPipeError:
+            return 0
 
-    def _recv(self, size: int) -> bytes:
-        return self._f.read(size)
+    def _transfer(self, operation, buffer, events, deadline):
+        """Run an overlapped ReadFile or WriteFile on `buffer` and return the bytes transferred.
+
+        Waits for the first of `events` to be signaled on completion.
+        The others only make the wait check the deadline again.
+        Once the deadline has passed, the operation is cancelled.
+        """
+        timeout = deadline.remaining()
+        overlapped = _Overlapped(hEvent=events[0])
+        handles = (wintypes.HANDLE * len(events))(*events)
+        transferred = wintypes.DWORD()
+        array = (ctypes.c_char * len(buffer)).from_buffer(buffer)
+        try:
+            if not operation(self._handle, array, len(buffer), None, ctypes.byref(overlapped)):
+                error = ctypes.get_last_error()
+                if error != ERROR_IO_PENDING:
+                    raise ctypes.WinError(error)
+
+            cancelled = False
+            while not cancelled:
+                result = _kernel32.WaitForMultipleObjects(len(events), handles, False,
+                                                          _wait_milliseconds(timeout))
+                if result == WAIT_OBJECT_0:
+                    break
+                elif result == WAIT_FAILED:
+                    raise ctypes.WinError(ctypes.get_last_error())
+                try:
+                    timeout = deadline.remaining()
+                except DiscordIpcTimeout:
+                    # Whatever was transferred before the cancellation still counts
+                    _kernel32.CancelIoEx(self._handle, ctypes.byref(overlapped))
+                    cancelled = True
+
+            if not _kernel32.GetOverlappedResult(self._handle, ctypes.byref(overlapped),
+                                                 ctypes.byref(transferred), True):
+                error = ctypes.get_last_error()
+                if cancelled and error == ERROR_OPERATION_ABORTED:
+                    raise deadline.timeout_error()
+                elif error != ERROR_MORE_DATA:
+                    raise ctypes.WinError(error)
+            return transferred.value
+        finally:
+            # Release the buffer before the caller's memoryview is
+            del array
+
+    def wakeup(self):
+        _kernel32.SetEvent(self._wakeup_event)
 
     def _close(self):
-        self._f.close()
+        if self._handle is None:
+            return
+        for handle in (self._handle, self._read_event, self._write_event, self._wakeup_event):
+            _kernel32.CloseHandle(handle)
+        self._handle = None
 
 
 class UnixDiscordIpcClient(DiscordIpcClient):
 
-    def _connect(self):
-        self._sock = socket.socket(socket.AF_UNIX)
+    def _iter_connections(self, deadline):
+        last = self._last_endpoint
+        if last is not None:
+            logger.debug("Attempting to connect to last endpoint %r", last)
+            sock = self._try_connect(last, deadline)
+            if sock is not None:
+                self._use(sock, last)
+                yield
+        candidates = [candidate for candidate in self._iter_path_candidates()
+                      if candidate != last and os.path.exists(candidate)]
+        for sock, path in self._probe(candidates, deadline):
+            self._use(sock, path)
+            yield
 
-        for path in self._iter_path_candidates():
-            if not os.path.exists(path):
-                logger.debug("%r not found", path)
-                continue
-            logger.debug("Attempting to connecting to %r", path)
-            try:
-                self._sock.connect(path)
-            except OSError as e:
-                logger.error("failed to connect to %r: %s", path, e)
-            except Exception as e:
-                logger.error("[!] failed to connect to %r", path, exc_info=e)
-            else:
-                break
-        else:
-            raise DiscordIpcError("Failed to connect to a Discord pipe")
+    def _use(self, sock, path):
+        # Deadlines of reads and writes are enforced with select,
+        # as the socket timeout would be shared between threads.
+        sock.settimeout(None)
+        self._sock = sock
+        self.path = path
+        self._wakeup_r, self._wakeup_w = socket.socketpair()
+        self._wakeup_r.setblocking(False)
+        self._wakeup_w.setblocking(False)
+
+    @staticmethod
+    def _try_connect(path, deadline):
+        sock = socket.socket(socket.AF_UNIX)
+        sock.settimeout(min(PROBE_TIMEOUT, deadline.remaining() or PROBE_TIMEOUT))
+        try:
+            sock.connect(path)
+        except OSError as e:
+            logger.debug("failed to connect to %r: %s", path, e)
+            sock.close()
+            return None
+        return sock
 
     @staticmethod
-    def _iter_path_candidates():
+    def _probe(candidates, deadline):
+        """Connect to all candidates at once and yield each socket as it accepts.
+
+        Candidates accepting right away come first, in the given order.
+        Sockets not yielded yet are closed along with the generator.
+        """
+        accepted = []
+        pending = {}
+        try:
+            for path in candidates:
+                logger.debug("Attempting to connect to %r", path)
+                sock = socket.socket(socket.AF_UNIX)
+                sock.setblocking(False)
+                err = sock.connect_ex(path)
+                if err == 0:
+                    accepted.append((sock, path))
+                elif err in (errno.EINPROGRESS, errno.EAGAIN):
+                    pending[sock] = path
+                else:
+                    logger.debug("failed to connect to %r: %s", path, os.strerror(err))
+                    sock.close()
+
+            while True:
+                while accepted:
+                    yield accepted.pop(0)
+                if not pending:
+                    return
+                timeout = min(PROBE_TIMEOUT, deadline.remaining() or PROBE_TIMEOUT)
+                _, writable, _ = select.select([], list(pending), [], timeout)
+                if not writable:
+                    deadline.remaining()
+                    return
+                for sock in writable:
+                    path = pending.pop(sock)
+                    err = sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+                    if err == 0:
+                        accepted.append((sock, path))
+                    else:
+                        logger.debug("failed to connect to %r: %s", path, os.strerror(err))
+                        sock.close()
+        finally:
+            for sock, _ in accepted:
+                sock.close()
+            for sock in pending:
+                sock.close()
+
+    @staticmethod
+    def endpoint_dirs():
+        """Directories that may contain Discord's IPC sockets, in order of preference."""
         env_keys = ('XDG_RUNTIME_DIR', 'TMPDIR', 'TMP', 'TEMP')
         for env_key in env_keys:
             dir_path = os.environ.get(env_key)
@@ -215,22 +1013,56 @@ class UnixDiscordIpcClient(DiscordIpcClient):
                 break
         else:
             dir_path = "/tmp"
-        snap_path = os.path.join(dir_path, "snap.discord")
-        if os.path.exists(snap_path):
-            for i in range(10):
-                yield os.path.join(snap_path, "discord-ipc-{}".format(i))
-        alt_snap_path = os.path.join(dir_path, "app", "com.discordapp.Discord")
-        if os.path.exists(alt_snap_path):
-            for i in range(10):
-                yield os.path.join(alt_snap_path, "discord-ipc-{}".format(i))
-        for i in range(10):
-            yield os.path.join(dir_path, "discord-ipc-{}".format(i))
-
-    def _write(self, data: bytes):
-        self._sock.sendall(data)
-
-    def _recv(self, size: int) -> bytes:
-        return self._sock.recv(size)
+        return [
+            os.path.join(dir_path, "snap.discord"),
+            os.path.join(dir_path, "app", "com.discordapp.Discord"),
+            dir_path,
+        ]
+
+    @classmethod
+    def _iter_path_candidates(cls):
+        dirs = cls.endpoint_dirs()
+        for dir_path in dirs:
+            # The runtime dir itself always exists
+            if dir_path is dirs[-1] or os.path.exists(dir_path):
+                for i in range(10):
+                    yield os.path.join(dir_path, ENDPOINT_PREFIX + str(i))
+
+    def _write(self, data: bytes, deadline):
+        if deadline.remaining() is None:
+            self._sock.sendall(data)
+            return
+
+        with memoryview(data) as view:
+            sent = 0
+            while sent < len(view):
+                _, writable, _ = select.select([], [self._sock], [], deadline.remaining())
+                if not writable:
+                    raise deadline.timeout_error()
+                try:
+                    sent += self._sock.send(view[sent:], socket.MSG_DONTWAIT)
+                except BlockingIOError:
+                    pass
+
+    def _recv_into(self, buffer: memoryview, deadline) -> int:
+        while True:
+            readable, _, _ = select.select([self._sock, self._wakeup_r], [], [], deadline.remaining())
+            if self._sock in readable:
+                return self._sock.recv_into(buffer)
+            elif not readable:
+                raise deadline.timeout_error()
+            try:
+                self._wakeup_r.recv(64)
+            except BlockingIOError:
+                pass
+
+    def wakeup(self):
+        try:
+            self._wakeup_w.send(b'\0')
+        except BlockingIOError:
+            pass  # Enough wakeups are pending already
 
     def _close(self):
         self._sock.close()
+        self._wakeup_r.close()
+        self._wakeup_w.close()
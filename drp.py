@@ -2,29 +2,68 @@ from functools import partial
 import logging
 import os
 import time
-import re
-import subprocess
 from time import mktime
 
 import sublime
 import sublime_plugin
 
 from . import discord_ipc
+from ._logging import payload_rate_limit, queue_handler
+from .helpers.backoff import Backoff, ConnectionState
+from .helpers.dispatch import ActivityDispatcher
+from .helpers.git import RemoteUrlCache
+from .helpers.icons import IconResolver
+from .helpers.metrics import BufferMetricsCache
+from .helpers.pipeline import ActivityPipeline
+from .helpers.presence import PresenceTracker
+from .helpers.projects import WindowIndex
+from .helpers.settings import SettingsSnapshot
+from .helpers.stats import SamplingProfiler, Stats
+from .helpers.syntaxes import SyntaxCache
+from .helpers.templates import LazyFields, compile_template
+from .helpers.watch import DirectoryWatcher
 
 SETTINGS_FILE = 'DiscordRichPresence.sublime-settings'
 settings = {}
+# Read-only copy of the settings, replaced when they change
+config = SettingsSnapshot({})
 DISCORD_CLIENT_ID = '389368374645227520'
-RECONNECT_DELAY = 15000
+# Delays between reconnection attempts grow from the first to the second value, in seconds
+RECONNECT_DELAY_MIN = 5
+RECONNECT_DELAY_MAX = 300
 
 logger = logging.getLogger(__name__)
 
-last_file = ''
-last_edit = 0
 ipc = None
-is_connecting = False
+# Last activity flushed for sending, sent again when connecting
+latest_activity = None
+connection_state = ConnectionState.DISCONNECTED
+backoff = Backoff(RECONNECT_DELAY_MIN, RECONNECT_DELAY_MAX)
+# Incremented to invalidate reconnection attempts that are already scheduled
+retry_token = 0
+# Watches for Discord's IPC endpoints to appear while backing off
+endpoint_watcher = None
+icon_resolver = IconResolver()
+git_remotes = RemoteUrlCache()
+# Window id -> WindowIndex
+window_indexes = {}
+buffer_metrics = BufferMetricsCache()
+# Display names are only available on ST4
+syntaxes = SyntaxCache(getattr(sublime, 'syntax_from_path', None))
+# Compiled from the settings of the same name
+details_template = None
+state_template = None
+git_button_template = None
+# Template fields read from the view when an event occurs
+gathered_fields = ()
+# Template fields resolved by the workers
+enriched_fields = ()
+# Timings and counters, recorded when the `performance_stats` setting is enabled
+stats = Stats()
+profiler = None
 
 start_time = mktime(time.localtime())
-stamp = start_time
+presence = PresenceTracker(start_time)
 
 
 def base_activity(started=False):
@@ -35,9 +74,9 @@ def base_activity(started=False):
             'large_image': 'sublime3',
             'large_text': 'Sublime Text v%s' % (sublime.version())
         },
-        'state': settings.get('start_state') if started else 'Idle'
+        'state': config.start_state if started else 'Idle'
     }
-    if settings.get('big_icon'):
+    if config.big_icon:
         activity['assets'] = {
             'large_image': 'afk',
             'large_text': 'Idle',
@@ -47,130 +86,18 @@ def base_activity(started=False):
     return activity
 
 
-# List of extensions mapped to language names.
-ICONS = {
-    'asm': 'assembly',
-    'ahk': 'ahk',
-    'c,h': 'c',
-    'clj,cljs,edn': 'clojure',
-    'coffeescript,coffee': 'coffeescript',
-    'cpp,hpp,cc,hxx,cxx': 'cpp',
-    'cr': 'crystal',
-    'cs': 'cs',
-    'css': 'css',
-    'd': 'd',
-    'dart': 'dart',
-    'ejs,tmpl': 'ejs',
-    'ex,exs': 'elixir',
-    'gitignore,gitattributes,gitmodules': 'git',
-    'go': 'go',
-    'ml,mli,mll,mly': 'ocaml',
-    'hs': 'haskell',
-    'htm,html,mhtml': 'html',
-    'hx': 'haxe',
-    'j2,jinja,jinja2': 'jinja',
-    'java,class,properties': 'java',
-    'js': 'javascript',
-    'json': 'json',
-    'jsx,tsx': 'react',
-    'kt': 'kotlin',
-    'lua': 'lua',
-    'md': 'markdown',
-    'php': 'php',
-    'png,jpg,jpeg,jfif,gif,webp': 'image',
-    'py,pyx': 'python',
-    'p,sp': 'pawn',
-    'r,rda,rdata,rds,rhistory': 'r',
-    'rb': 'ruby',
-    'rs': 'rust',
-    'sh,bat': 'shell',
-    'swift': 'swift',
-    'svelte': 'svelte',
-    't': 'perl',
-    'toml': 'toml',
-    'ts': 'typescript',
-    'tex,bib': 'latex',
-    'txt,rst,rest': 'text',
-    'vue': 'vue',
-    'xml,svg,yml,yaml,cfg,ini': 'xml',
-    'yar,yara': 'yara',
-    'pp,pas,inc': 'pascal',
-    'scss,sass': 'sass',
-    'nim': 'nim',
-    'nite,nitecode,nightcode,nc': 'nitecode',
-    'p6,pm6,pod6,raku,rakumod,rakudoc,rakutest,nqp,crotmp': 'raku',
-    'gml,yy': 'gml',
-    'factor,facts': 'factor'
-}
+def get_icon(file, ext, scope, syntax=None):
+    icon = icon_resolver.resolve(file, ext, scope, syntax)
+    logger.debug('Using icon "%s" for file %s (scope: %s)', icon, file, scope.split(' ', 1)[0])
 
-# Scopes we can/should fallback to
-SCOPES = {
-    'assembly',
-    'ahk',
-    'c',
-    'clojure',
-    'cpp',
-    'cs',
-    'css',
-    'd',
-    'erlang',
-    'haxe',
-    'html',
-    'java',
-    'json',
-    'latex',
-    'pde',
-    'perl',
-    'php',
-    'pawn',
-    'python',
-    'r',
-    'scala',
-    'svelte',
-    'yara',
-    'pascal',
-    'ocaml',
-    'v',
-    'sass',
-    'nim',
-    'nitecode',
-    'raku',
-    'gml',
-    'factor'
-}
+    return 'https://raw.githubusercontent.com/Snazzah/SublimeDiscordRP/master/icons/lang-%s.png' % icon
 
 
-def get_icon(file, ext, _scope):
-    main_scope = _scope.split()[0]
+def get_extension(entity):
     try:
-        sub_scope = '.'.join(main_scope.split()[0].split('.')[1::])
+        return entity.split('.')[len(entity.split('.')) - 1]
     except Exception:
-        sub_scope = ''
-
-    for _icon in ICONS:
-        if ext in _icon.split(','):
-            icon = ICONS[_icon]
-            break
-        else:
-            for scope in yield_subscopes(sub_scope):
-                if scope.replace(',', '') in SCOPES:
-                    icon = scope.replace(',', '')
-                    break
-                else:
-                    icon = 'unknown'
-
-    if file == 'LICENSE':
-        icon = 'license'
-    logger.debug('Using icon "%s" for file %s (scope: %s)', icon, file, main_scope)
-
-    return 'https://raw.githubusercontent.com/Snazzah/SublimeDiscordRP/master/icons/lang-%s.png' % icon
-
-
-def yield_subscopes(scope):
-    last_dot = len(scope)
-    while last_dot > 0:
-        yield scope[:last_dot]
-        last_dot = scope[:last_dot].rfind('.')
+        return ''
 
 
 def sizehf(num):
@@ -182,187 +109,226 @@ def sizehf(num):
 
 
 def handle_activity(view):
+    """Gather what the activity needs from `view` and build it on a worker thread."""
+    started = time.perf_counter()
     window = view.window()
     entity = view.file_name()
-    if not (ipc and window and entity):
+    if not (ipc and window and entity) or not presence.owns(window.id()):
         return
 
-    act = base_activity()
-
-    # TODO refactor these globals
-    global last_file
-    global last_edit
-    global stamp
-    if last_file != entity and settings.get('time_per_file'):
+    state = presence.window(window.id())
+    presence.present(window.id())
+    if state.last_file != entity and config.time_per_file:
         logger.info('adding new timestamp')
-        stamp = mktime(time.localtime())
+        state.stamp = mktime(time.localtime())
 
     logger.info('Updating activity')
 
-    try:
-        extension = entity.split('.')[len(entity.split('.')) - 1]
-    except Exception:
-        extension = ''
-
-    language = os.path.splitext(os.path.basename(view.settings().get('syntax')))[0]
-    if len(language) < 2:
-        language = language.upper() + ' Syntax'
-    format_dict = dict(
-        file=os.path.basename(entity),
-        extension=extension,
-        lang=language,
-        project=get_project_name(window, entity),
-        size=view.size(),
-        sizehf=sizehf(view.size()),
-        loc=view.rowcol(view.size())[0] + 1,
-        folders=len(window.folders()),
-    )
-    last_file = entity
-    last_edit = time.time()
-
-    details_format = settings.get('details')
-    if details_format:
-        act['details'] = details_format.format(**format_dict)
-
-    state_format = settings.get('state')
-    if state_format:
-        act['state'] = state_format.format(**format_dict)
-
-    main_scope = view.scope_name(0)
-    icon = get_icon(format_dict['file'], format_dict['extension'], main_scope)
-    if settings.get('big_icon'):
+    syntax = syntaxes.get(view.settings().get('syntax'), partial(view.scope_name, 0))
+    fields = LazyFields(TEMPLATE_FIELDS, view=view, window=window, entity=entity,
+                        index=get_window_index(window), syntax=syntax)
+    state.last_file = entity
+    state.last_edit = time.time()
+
+    # Read everything that needs the view now, the rest is computed by the worker
+    for name in gathered_fields:
+        fields[name]
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("Window folders: %s", window.folders())
+
+    pipeline.record('gather', time.perf_counter() - started)
+    pipeline.submit(window.id(), partial(build_window_activity, state, view.change_count(),
+                                         fields, state.stamp, started))
+
+
+def build_window_activity(state, change_count, fields, stamp, since):
+    act = build_activity(fields, stamp)
+    state.remember(fields.entity, change_count, act)
+    return act, since
+
+
+def present_cached_activity(window, state, entity, act):
+    """Show an activity built earlier for `entity`, only updating its timestamp."""
+    if state.last_file != entity:
+        if config.time_per_file:
+            state.stamp = mktime(time.localtime())
+        state.last_file = entity
+        if config.show_elapsed_time:
+            act = dict(act, timestamps={'start': state.stamp})
+    logger.info('Updating activity from cache')
+    since = stats.clock()
+    pipeline.submit(window.id(), lambda: (act, since))
+
+
+def build_activity(fields, stamp):
+    """Render the activity from gathered fields, resolving the project and repository."""
+    act = base_activity()
+
+    for name in enriched_fields:
+        started = stats.clock()
+        fields[name]
+        stats.record(name, started)
+
+    started = stats.clock()
+    if details_template:
+        act['details'] = details_template.render(fields)
+
+    if state_template:
+        act['state'] = state_template.render(fields)
+    stats.record('template', started)
+
+    started = stats.clock()
+    icon = get_icon(fields['file'], fields['extension'], fields.syntax.scope, fields.syntax.path)
+    stats.record('icon', started)
+    language = fields['lang']
+    if config.big_icon:
         act['assets']['small_text'] = act['assets']['small_text']
         act['assets']['large_image'] = icon
         act['assets']['large_text'] = language
-    elif settings.get('small_icon'):
+    elif config.small_icon:
         act['assets']['small_image'] = icon
         act['assets']['small_text'] = language
 
-    if settings.get('show_elapsed_time'):
+    if config.show_elapsed_time:
         act['timestamps'] = {'start': stamp}
 
-    if settings.get('git_repository_button'):
-        git_url = get_git_url(entity)
-        git_btn_format = settings.get('git_repository_message')
+    if config.git_repository_button:
+        started = stats.clock()
+        git_url = get_git_url(fields.entity)
+        stats.record('git', started)
 
-        if git_btn_format and git_url is not None:
-            act['buttons'] = [{'label': git_btn_format.format(**format_dict), 'url': git_url}]
+        if git_button_template and git_url is not None:
+            act['buttons'] = [{'label': git_button_template.render(fields), 'url': git_url}]
 
-    logger.info(window.folders())
-    try:
-        ipc.set_activity(act)
-    except OSError as e:
-        handle_error(e)
+    return act
+
+
+# Values for the template fields, computed only if a template references them
+TEMPLATE_FIELDS = {
+    'file': lambda f: os.path.basename(f.entity),
+    'extension': lambda f: get_extension(f.entity),
+    'lang': lambda f: f.syntax.language,
+    'project': lambda f: get_project_name(f.index, f.entity),
+    'size': lambda f: buffer_metrics.get(f.view).size,
+    'sizehf': lambda f: sizehf(f['size']),
+    'loc': lambda f: buffer_metrics.get(f.view).lines,
+    'folders': lambda f: len(f.index.folders.folders),
+}
+# Fields that are resolved on the worker threads and must not be gathered
+ENRICHED_FIELDS = frozenset({'project'})
+# Fields needed in every activity
+ACTIVITY_FIELDS = frozenset({'file', 'extension', 'lang'})
 
 
 def reset_activity(started = False):
     if not ipc:
         return
-    global last_file
-    last_file = ''
-    try: ipc.set_activity(base_activity(started))
-    except OSError as e: handle_error(e)
+    presence.reset()
+    # Queued like other activities, so that it supersedes those still being built
+    since = stats.clock()
+    pipeline.submit(None, lambda: (base_activity(started), since))
+
+
+def send_activity(act, since=None):
+    global latest_activity
+    latest_activity = act
+    # Runs on the sender thread while the async thread may replace or drop the connection
+    client = ipc
+    if not client:
+        return
+    sent_at = stats.clock()
+    future = client.set_activity(act, timeout=config.request_timeout)
+    # From the event that caused the update until it was written
+    stats.record('event_to_send', since)
+    future.add_done_callback(partial(_on_activity_sent, client, sent_at))
+
+
+def _on_activity_sent(client, sent_at, future):
+    # Called on the IPC reader thread
+    exc = future.exception()
+    if exc is None:
+        stats.record('ipc_round_trip', sent_at)
+        reply = future.result()
+        if reply and reply[1].get('evt') == 'ERROR':
+            logger.error("Discord rejected the activity: %s", reply[1].get('data'))
+    elif client is ipc and client.error is None:
+        # Lost connections are handled by on_connection_lost
+        sublime.set_timeout_async(partial(handle_error, exc), 0)
+
+
+# Activities are built on worker threads and sent from the pipeline's sender thread
+pipeline = ActivityPipeline(lambda result: dispatcher.submit(*result))
+dispatcher = ActivityDispatcher(send_activity, pipeline.schedule)
 
 
 def handle_error(exc, retry=True):
+    stats.count('send_errors')
     sublime.active_window().status_message("[DiscordRP] Sending activity failed")
     logger.error("Sending activity failed. Error: %s", exc)
     disconnect()
 
     if retry:
-        global is_connecting
-        is_connecting = True
-        sublime.set_timeout_async(connect_background, 0)
-
-
-def git_config_parser(path):
-    obj = dict()
-    with open(path) as cfg:
-        lines = cfg.read().split("\n")
-        current_section = None
-
-        for line in lines:
-            # remove comments and spaces
-            line = re.sub(" |;(.*)|#(.*)", "", line)
-            if not line:
-                continue
-
-            if line.startswith("["):
-                res = re.search('"(.*)"', line)
-                if res is not None:
-                    sec_name = re.sub(r'\[|"(.*)"|\]', "", line)
-                    subsec_name = res.group(1)
-                    if sec_name not in obj:
-                        obj[sec_name] = {}
-
-                    obj[sec_name][subsec_name] = {}
-                    current_section = [sec_name, subsec_name]
-                else:
-                    sec_name = re.sub(r"\[|\]", "", line)
-                    obj[sec_name] = {}
-                    current_section = [sec_name]
-
-            else:
-                parts = re.sub("\t|\0", "", line).split("=")
-                if len(current_section) < 2:
-                    obj[current_section[0]][parts[0]] = parts[1]
-                else:
-                    obj[current_section[0]][current_section[1]][parts[0]] = parts[1]
-
-    return obj
+        schedule_reconnect(0)
 
 
-def get_git_url_from_config(folder):
-    gitcfg_path = folder + "/.git/config"
-    if os.path.exists(gitcfg_path):
-        cfg = git_config_parser(gitcfg_path)
-        if "remote" in cfg and "origin" in cfg["remote"]:
-            return cfg["remote"]["origin"]["url"]
+def on_connection_lost(client, exc):
+    # Called from the IPC reader thread
+    sublime.set_timeout_async(partial(handle_connection_lost, client, exc), 0)
 
-    return None
 
+def handle_connection_lost(client, exc):
+    """Reconnect in the background after Discord closed the connection or went away.
 
-def parse_git_url(url):
-    url = re.sub(r"\.git\n?$", "", url)
-    if url.startswith("https"):
-        return url
+    The latest activity is sent again with the handshake.
+    """
+    global ipc
+    if client is not ipc:
+        # Disconnected or replaced in the meantime
+        return
+    stats.count('connections_lost')
+    sublime.active_window().status_message("[DiscordRP] Connection to Discord lost, reconnecting")
+    logger.warning("Connection to Discord client lost: %s", exc)
+    ipc = None
+    try:
+        client.close()
+    except OSError as e:
+        logger.debug("Error while closing lost connection", exc_info=e)
+    schedule_reconnect(0)
 
-    elif url.startswith("git@") or url.startswith("ssh"):
-        url = url.replace(":", "/")
-        return re.sub("git@|ssh///", "https://", url)
 
-    else:
-        return None
+def get_window_index(window):
+    """Return the index of a window, rebuilding it when its folders or project changed."""
+    folders = window.folders()
+    project_file = window.project_file_name()
+    index = window_indexes.get(window.id())
+    if index is None or not index.is_current(folders, project_file):
+        index = window_indexes[window.id()] = WindowIndex(folders, project_file)
+        # Repositories may have been added or removed along with the folders
+        git_remotes.repo_index.clear()
+        # Cached activities show the project and folders of the old index
+        presence.forget_window_activities(window.id())
+    return index
 
 
 def get_git_url(entity):
-    folder = os.path.dirname(entity)
-    url = None
-    try:
-        si = None
-        if os.name == 'nt':
-            si = subprocess.STARTUPINFO()
-            si.dwFlags = subprocess.SW_HIDE | subprocess.STARTF_USESHOWWINDOW
-        url = subprocess.check_output(["git", "-C", folder, "remote", "get-url", "origin"], universal_newlines=True, startupinfo=si)
-    except Exception:
-        url = get_git_url_from_config(folder)
+    return git_remotes.get_url(os.path.dirname(entity))
 
-    if url is not None:
-        url = parse_git_url(url).strip()
-        return url
 
-    return None
+def get_project_name(index, current_file):
+    project = index.projects.get(current_file)
+    if project is None:
+        project = index.projects[current_file] = resolve_project_name(index, current_file)
+    return project
 
 
-def get_project_name(window, current_file):
-    sources = settings.get("project_name", [])
-    for source in sources:
+def resolve_project_name(index, current_file):
+    for source in config.project_name:
         if source == "project_folder_name":
-            folder = find_folder_containing_file(window.folders(), current_file)
+            folder = index.folders.find(current_file)
             if folder:
                 return os.path.basename(folder)
         elif source == "project_file_name":
-            project_file_path = window.project_file_name()
+            project_file_path = index.project_file
             if project_file_path:
                 return os.path.splitext(os.path.basename(project_file_path))[0]
         elif source == "folder_name":
@@ -370,20 +336,10 @@ def get_project_name(window, current_file):
                 return os.path.basename(os.path.abspath(os.path.join(os.path.dirname(current_file), os.pardir)))
             else:
                 return os.path.basename(os.path.dirname(current_file))
-        else:
-            logger.error("Unknown source for `project_name` setting: %r", source)
 
     return "No project"
 
 
-def find_folder_containing_file(folders, current_file):
-    for folder in folders:
-        real_folder = os.path.realpath(folder)
-        if os.path.realpath(current_file).startswith(real_folder):
-            return folder
-    return None
-
-
 def is_view_active(view):
     if not view:
         return False
@@ -406,10 +362,36 @@ def connect(silent=False, retry=True):
         logger.error("Already connected")
         return True
 
+    set_connection_state(ConnectionState.CONNECTING)
+    stats.count('connect_attempts')
+    act = latest_activity
+    if act is None:
+        act = base_activity(True)
+        if config.show_elapsed_time:
+            act['timestamps'] = {'start': start_time}
+
     try:
-        ipc = discord_ipc.DiscordIpcClient.for_platform(DISCORD_CLIENT_ID)
-    except (OSError, discord_ipc.DiscordIpcError) as e:
-        logger.info("Unable to connect to Discord client")
+        # The initial activity is sent along with the handshake
+        client = discord_ipc.DiscordIpcClient.for_platform(
+            DISCORD_CLIENT_ID,
+            activity=act,
+            connect_timeout=config.connect_timeout,
+            handshake_timeout=config.handshake_timeout,
+            connection_timeout=config.connection_timeout,
+            timeout=config.request_timeout,
+        )
+    except Exception as e:
+        # Every failure must end in another attempt or the disconnected state
+        stats.count('connect_failures')
+        if isinstance(e, discord_ipc.DiscordIpcTimeout):
+            # Likely a stale socket left behind by a Discord client that is gone
+            logger.warning("Discord client did not respond in time: %s", e)
+        elif isinstance(e, discord_ipc.DiscordIpcProtocolError):
+            logger.warning("Discord client refused the connection: %s", e)
+        elif isinstance(e, (OSError, discord_ipc.DiscordIpcError)):
+            logger.info("Unable to connect to Discord client")
+        else:
+            logger.exception("Unexpected error while connecting to Discord client")
         logger.debug("Error while connecting", exc_info=e)
         if not silent:
             sublime.error_message("[DiscordRP] Unable to connect to Discord client."
@@ -417,77 +399,168 @@ def connect(silent=False, retry=True):
                                   " Run 'Discord Rich Presence: Connect to Discord'"
                                   " to try again.")
         if retry:
-            global is_connecting
-            is_connecting = True
-            sublime.set_timeout_async(connect_background, RECONNECT_DELAY)
+            schedule_reconnect()
+        else:
+            set_connection_state(ConnectionState.DISCONNECTED)
         return
 
-    act = base_activity(True)
-    if settings.get('show_elapsed_time'):
-        act['timestamps'] = {'start': start_time}
+    ipc = discord_ipc.PipelinedIpcClient(client, on_close=on_connection_lost)
+    backoff.reset()
+    set_connection_state(ConnectionState.READY)
+    return True
 
-    try:
-        ipc.set_activity(act)
-    except OSError as e:
-        handle_error(e, retry=retry)
-        return
 
-    return True
+def set_connection_state(state):
+    global connection_state, endpoint_watcher
+    if state != connection_state:
+        logger.debug("Connection state changed from %s to %s", connection_state, state)
+    connection_state = state
+
+    if state == ConnectionState.BACKING_OFF:
+        if endpoint_watcher is None:
+            endpoint_watcher = DirectoryWatcher(
+                discord_ipc.DiscordIpcClient.class_for_platform().endpoint_dirs(),
+                lambda name: name.startswith(discord_ipc.ENDPOINT_PREFIX),
+                on_endpoint_created,
+            )
+            endpoint_watcher.start()
+    elif endpoint_watcher is not None:
+        endpoint_watcher.stop()
+        endpoint_watcher = None
+
+
+def schedule_reconnect(delay=None):
+    """Back off and reconnect after `delay` seconds, or the next backoff delay."""
+    global retry_token
+    if delay is None:
+        delay = backoff.next_delay()
+    retry_token += 1
+    set_connection_state(ConnectionState.BACKING_OFF)
+    logger.info("Reconnecting to Discord client in %.1f seconds", delay)
+    sublime.set_timeout_async(partial(connect_background, retry_token), int(delay * 1000))
+
+
+def on_endpoint_created(name):
+    # Called from the watcher's thread
+    sublime.set_timeout_async(partial(_reconnect_now, name), 0)
 
 
-def connect_background():
-    if not is_connecting:
-        logger.warning("Automatic connection retry aborted")
+def _reconnect_now(name):
+    if connection_state == ConnectionState.BACKING_OFF:
+        logger.info("Discord IPC endpoint %r appeared", name)
+        schedule_reconnect(0)
+
+
+def connect_background(token):
+    if connection_state != ConnectionState.BACKING_OFF or token != retry_token:
+        logger.debug("Scheduled reconnection attempt superseded or aborted")
         return
 
     logger.info("Trying to reconnect to Discord client...")
-    if not connect(silent=True, retry=False):
-        sublime.set_timeout_async(connect_background, RECONNECT_DELAY)
+    stats.count('reconnect_attempts')
+    connect(silent=True)
 
 
 def disconnect():
     global ipc
+    set_connection_state(ConnectionState.DISCONNECTED)
+    dispatcher.clear()
     if ipc:
         try:
-            ipc.clear_activity()
+            ipc.clear_activity(timeout=config.request_timeout).result()
+        except OSError as e:
+            logger.debug("Error while clearing activity", exc_info=e)
+        try:
             ipc.close()
         except OSError as e:
             logger.debug("Error while disconnecting", exc_info=e)
         ipc = None
 
 
-deactivate_bounce_count = 0
-
-
-def _bounce_deactivate(expected_bounce_count):
-    if deactivate_bounce_count == expected_bounce_count:
+def _bounce_deactivate(expected_idle_generation):
+    if presence.idle_generation == expected_idle_generation:
         logger.debug("Idle timeout reached")
         reset_activity()
 
 
+def on_syntax_changed(view):
+    """Refresh the presence of a view that was assigned another syntax."""
+    window = view.window()
+    if window and is_view_active(view):
+        # Language and icon of the cached activity are outdated
+        presence.window(window.id()).files.pop(view.file_name(), None)
+        handle_activity(view)
+
+
 class DRPListener(sublime_plugin.EventListener):
 
     def on_activated_async(self, view):
-        global last_file
-        global deactivate_bounce_count
-        deactivate_bounce_count += 1
+        presence.idle_generation += 1
 
-        if not is_view_active(view) or view.file_name() == last_file:
+        if not is_view_active(view):
+            return
+        window = view.window()
+        entity = view.file_name()
+        if not (ipc and window and entity) or not presence.owns(window.id()):
             return
-        logger.debug("Setting presence to file %r from %r", view.file_name(), last_file)
-        handle_activity(view)
+
+        state = presence.window(window.id())
+        if presence.present(window.id()) and entity == state.last_file:
+            return
+        logger.debug("Setting presence to file %r from %r", entity, state.last_file)
+
+        get_window_index(window)  # Drops cached activities if the folders changed
+        act = state.cached_activity(entity, view.change_count())
+        if act is not None:
+            present_cached_activity(window, state, entity, act)
+        else:
+            handle_activity(view)
 
     def on_post_save_async(self, view):
         # Refresh template variables
         handle_activity(view)
 
+    def on_post_text_command(self, view, command_name, args):
+        if command_name == 'set_file_type':
+            sublime.set_timeout_async(partial(on_syntax_changed, view))
+
+    def on_close(self, view):
+        buffer_metrics.discard(view.buffer_id())
+
+    def on_pre_close_window(self, window):
+        window_indexes.pop(window.id(), None)
+        presence.discard_window(window.id())
+
     def on_deactivated_async(self, _view):
-        global deactivate_bounce_count
-        deactivate_bounce_count += 1
+        presence.idle_generation += 1
 
-        timeout = settings.get('idle_timeout', 0) * 1000
+        timeout = config.idle_timeout * 1000
         if timeout:
-            sublime.set_timeout_async(partial(_bounce_deactivate, deactivate_bounce_count), timeout)
+            sublime.set_timeout_async(partial(_bounce_deactivate, presence.idle_generation), timeout)
+
+
+if hasattr(sublime_plugin, 'TextChangeListener'):  # ST4
+
+    class DRPTextChangeListener(sublime_plugin.TextChangeListener):
+
+        def __init__(self):
+            super().__init__()
+            self.change_count = None
+
+        @classmethod
+        def is_applicable(cls, buffer):
+            # Listeners are only attached to buffers they declare themselves applicable to
+            return buffer.primary_view() is not None
+
+        def on_text_changed(self, changes):
+            # Keep the buffer's metrics current without recomputing them
+            view = self.buffer.primary_view()
+            if view is None:
+                self.change_count = None
+                return
+            change_count = view.change_count()
+            buffer_metrics.apply_changes(self.buffer.buffer_id, self.change_count, change_count, changes)
+            self.change_count = change_count
 
 
 class DiscordrpConnectCommand(sublime_plugin.ApplicationCommand):
@@ -502,6 +575,54 @@ class DiscordrpConnectCommand(sublime_plugin.ApplicationCommand):
         connect()
 
 
+def performance_report():
+    lines = []
+    if not stats.enabled:
+        lines += ["Timings are not recorded, enable the `performance_stats` setting.", ""]
+    lines += stats.report()
+
+    pipeline_stats = pipeline.stats()
+    lines += [
+        "",
+        "connection             %s" % connection_state,
+        "pipeline depth         %8d" % pipeline_stats['depth'],
+        "jobs dropped           %8d" % pipeline_stats['dropped'],
+        "jobs superseded        %8d" % pipeline_stats['superseded'],
+        "results stale          %8d" % pipeline_stats['stale'],
+        "updates submitted      %8d" % dispatcher.submitted,
+        "updates coalesced      %8d" % dispatcher.coalesced,
+        "updates sent           %8d" % dispatcher.sent,
+        "log records dropped    %8d" % queue_handler.dropped,
+        "payload logs limited   %8d" % payload_rate_limit.suppressed,
+        "",
+        "%-22s %8s %9s %9s" % ("pipeline stage (ms)", "count", "mean", "max"),
+    ]
+    for name, stage in pipeline_stats['stages'].items():
+        lines.append("%-22s %8d %9.3f %9.3f" % (name, stage['count'], stage['mean'] * 1000,
+                                                 stage['max'] * 1000))
+    lines += [
+        "",
+        "%-22s %8s %9s" % ("cache", "hits", "misses"),
+        "%-22s %8d %9d" % ("git remotes", git_remotes.hits, git_remotes.misses),
+        "%-22s %8d %9d" % ("repository roots", git_remotes.repo_index.hits,
+                           git_remotes.repo_index.misses),
+        "%-22s %8d %9d" % ("buffer metrics", buffer_metrics.hits, buffer_metrics.misses),
+        "%-22s %8d %9d" % ("syntaxes", syntaxes.hits, syntaxes.misses),
+    ]
+    if profiler is not None:
+        lines += ["", "Profile (%d samples)" % profiler.total] + profiler.report()
+    return "\n".join(lines) + "\n"
+
+
+class DiscordrpShowStatsCommand(sublime_plugin.ApplicationCommand):
+
+    def run(self):
+        window = sublime.active_window()
+        panel = window.create_output_panel('discordrp_stats')
+        panel.run_command('append', {'characters': performance_report()})
+        window.run_command('show_panel', {'panel': 'output.discordrp_stats'})
+
+
 class DiscordrpReconnectCommand(sublime_plugin.ApplicationCommand):
 
     def is_enabled(self):
@@ -518,25 +639,83 @@ class DiscordrpReconnectCommand(sublime_plugin.ApplicationCommand):
 class DiscordrpDisconnectCommand(sublime_plugin.ApplicationCommand):
 
     def is_enabled(self):
-        return bool(ipc) or is_connecting
+        return bool(ipc) or connection_state != ConnectionState.DISCONNECTED
 
     def run(self):
         sublime.set_timeout_async(self.run_async)
 
     def run_async(self):
-        global is_connecting
-        is_connecting = False
+        global latest_activity
         disconnect()
+        # Start over from the initial activity when connecting again
+        latest_activity = None
+
+
+class DiscordrpPinWindowCommand(sublime_plugin.WindowCommand):
+
+    def is_visible(self):
+        return config.window_policy == 'pinned'
+
+    def is_enabled(self):
+        return presence.pinned != self.window.id()
+
+    def run(self):
+        presence.pin(self.window.id())
+        view = self.window.active_view()
+        if view:
+            sublime.set_timeout_async(partial(handle_activity, view))
+
+
+def on_settings_reload():
+    global config, icon_resolver
+    new_config = SettingsSnapshot(settings)
+    icon_resolver = IconResolver(new_config.icon_overrides)
+    dispatcher.interval = new_config.update_interval
+
+    global details_template, state_template, git_button_template
+    details_template = compile_template(new_config.details, TEMPLATE_FIELDS, 'details')
+    state_template = compile_template(new_config.state, TEMPLATE_FIELDS, 'state')
+    git_button_template = compile_template(new_config.git_repository_message, TEMPLATE_FIELDS,
+                                           'git_repository_message')
+    global gathered_fields, enriched_fields
+    used_fields = set(ACTIVITY_FIELDS)
+    for template in (details_template, state_template, git_button_template):
+        if template:
+            used_fields |= template.fields
+    gathered_fields = tuple(used_fields - ENRICHED_FIELDS)
+    enriched_fields = tuple(used_fields & ENRICHED_FIELDS)
+    config = new_config
+    # Resolved project names and built activities depend on the settings
+    window_indexes.clear()
+    syntaxes.clear()
+    presence.set_policy(config.window_policy)
+    presence.forget_activities()
+
+    global profiler
+    stats.enabled = config.performance_stats
+    if config.profiler and profiler is None:
+        # The reader blocks in select() and the watcher in read() or sleep()
+        profiler = SamplingProfiler(os.path.dirname(__file__),
+                                    idle=('_recv_into', '_read_inotify', '_poll'))
+        profiler.start()
+    elif not config.profiler and profiler is not None:
+        profiler.stop()
+        profiler = None
 
 
 def plugin_loaded():
     global settings
     settings = sublime.load_settings(SETTINGS_FILE)
-    if settings.get('connect_on_startup'):
+    settings.add_on_change(__name__, on_settings_reload)
+    on_settings_reload()
+    pipeline.start()
+    if config.connect_on_startup:
         sublime.set_timeout_async(partial(connect, silent=True), 0)
 
 
 def plugin_unloaded():
-    global is_connecting
-    is_connecting = False
+    settings.clear_on_change(__name__)
     disconnect()
+    pipeline.stop()
+    if profiler is not None:
+        profiler.stop()
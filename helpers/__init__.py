@@ -0,0 +1,4 @@
+# Sublime-independent building blocks used by drp.py.
+#
+# Modules in here must not import `sublime` or `sublime_plugin` at load time,
+# so they can be exercised outside of the editor.
@@ -0,0 +1,41 @@
+import random
+
+
+class ConnectionState:
+
+    """States of the connection to the Discord client."""
+
+    DISCONNECTED = 'disconnected'
+    CONNECTING = 'connecting'
+    READY = 'ready'
+    BACKING_OFF = 'backing-off'
+
+
+class Backoff:
+
+    """Exponentially growing delays with random jitter and a ceiling.
+
+    The n-th delay is `initial * factor ** n`, capped at `maximum`,
+    and then reduced by up to `jitter` (a fraction) at random,
+    so that several clients do not retry in lockstep.
+    `attempts` stops growing once the ceiling is reached.
+    """
+
+    def __init__(self, initial=5.0, maximum=300.0, factor=2.0, jitter=0.2):
+        self.initial = initial
+        self.maximum = maximum
+        self.factor = factor
+        self.jitter = jitter
+        self.attempts = 0
+
+    def next_delay(self):
+        delay = self.initial * self.factor ** self.attempts
+        if delay < self.maximum:
+            self.attempts += 1
+        else:
+            # Stop growing, the power would overflow eventually
+            delay = self.maximum
+        return delay * (1 - self.jitter * random.random())
+
+    def reset(self):
+        self.attempts = 0
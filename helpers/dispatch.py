@@ -0,0 +1,72 @@
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+_NOTHING = object()
+
+
+class ActivityDispatcher:
+
+    """Coalesces activity updates and rate-limits how often they are sent.
+
+    Only the most recently submitted activity is kept.
+    It is sent right away if nothing was sent during the last `interval` seconds,
+    otherwise once the interval has passed,
+    so a burst of updates results in at most one write per interval.
+
+    `send` is called with the activity to send and the `since` value it was submitted with,
+    and `schedule` with a callback and a delay in milliseconds,
+    e.g. `sublime.set_timeout_async`.
+    """
+
+    def __init__(self, send, schedule, interval=4.0):
+        self._send = send
+        self._schedule = schedule
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._pending = _NOTHING
+        self._pending_since = None
+        self._scheduled = False
+        self._last_flush = None
+        self.submitted = 0
+        self.sent = 0
+        self.coalesced = 0
+
+    def submit(self, activity, since=None):
+        """Send `activity` soon.
+
+        `since` is passed on to `send`, e.g. the time of the event that caused the update.
+        """
+        with self._lock:
+            self.submitted += 1
+            if self._pending is not _NOTHING:
+                self.coalesced += 1
+            self._pending = activity
+            self._pending_since = since
+            if self._scheduled:
+                return
+            self._scheduled = True
+            delay = 0
+            if self._last_flush is not None:
+                delay = max(0, self._last_flush + self.interval - time.monotonic())
+        self._schedule(self._flush, int(delay * 1000))
+
+    def clear(self):
+        """Drop the pending activity, if any."""
+        with self._lock:
+            self._pending = _NOTHING
+
+    def _flush(self):
+        with self._lock:
+            activity = self._pending
+            since = self._pending_since
+            self._pending = _NOTHING
+            self._scheduled = False
+            if activity is _NOTHING:
+                return
+            self._last_flush = time.monotonic()
+            self.sent += 1
+        logger.debug("Flushing activity (%d sent, %d coalesced so far)", self.sent, self.coalesced)
+        self._send(activity, since)
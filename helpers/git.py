@@ -0,0 +1,210 @@
+from collections import OrderedDict
+import logging
+import os
+import re
+import subprocess
+import threading
+import time
+
+from .gitconfig import find_value
+
+logger = logging.getLogger(__name__)
+
+
+# config path -> (signatures of the files read, url)
+_config_urls = {}
+
+
+def get_git_url_from_config(config_path, git_dir=None):
+    """Read the URL of the `origin` remote from a config file and the files it includes.
+
+    Results are cached until the mtime or size of one of the files read changes.
+    """
+    entry = _config_urls.get(config_path)
+    if entry is not None and all(_stat_signature(path) == signature
+                                 for path, signature in entry[0]):
+        return entry[1]
+
+    if git_dir is None:
+        git_dir = os.path.dirname(config_path)
+    files = []
+    url = find_value(config_path, 'remote', 'origin', 'url', git_dir, files)
+    _config_urls[config_path] = (tuple(files), url)
+    return url
+
+
+def parse_git_url(url):
+    url = re.sub(r"\.git\n?$", "", url)
+    if url.startswith("https"):
+        return url
+
+    elif url.startswith("git@") or url.startswith("ssh"):
+        url = url.replace(":", "/")
+        return re.sub("git@|ssh///", "https://", url)
+
+    else:
+        return None
+
+
+def get_git_url_from_git(folder):
+    si = None
+    if os.name == 'nt':
+        si = subprocess.STARTUPINFO()
+        si.dwFlags = subprocess.SW_HIDE | subprocess.STARTF_USESHOWWINDOW
+    return subprocess.check_output(["git", "-C", folder, "remote", "get-url", "origin"],
+                                   universal_newlines=True, startupinfo=si)
+
+
+class RepoRootIndex:
+
+    """Bounded LRU mapping of directories to the root of the repository containing them.
+
+    Negative results (directories outside of any repository) are remembered as well.
+    When walking up from an unknown directory,
+    the walk stops at the first ancestor that is already indexed,
+    so files in the same tree share one lookup.
+    Entries are re-checked against the filesystem after `ttl` seconds
+    so that `.git` directories appearing or disappearing are picked up;
+    call `clear` to force this immediately.
+    Safe to use from several threads.
+    """
+
+    def __init__(self, maxsize=1024, ttl=10.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        # folder -> (repo root or None, time of the check)
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def lookup(self, folder):
+        with self._lock:
+            return self._lookup(folder)
+
+    def _lookup(self, folder):
+        now = time.monotonic()
+        entry = self._entries.get(folder)
+        if entry is not None and now - entry[1] < self.ttl:
+            self._entries.move_to_end(folder)
+            self.hits += 1
+            return entry[0]
+
+        self.misses += 1
+        visited = []
+        current = folder
+        while True:
+            entry = self._entries.get(current)
+            if visited and entry is not None and now - entry[1] < self.ttl:
+                root, checked_at = entry
+                break
+            visited.append(current)
+            if os.path.exists(os.path.join(current, ".git")):
+                root, checked_at = current, now
+                break
+            parent = os.path.dirname(current)
+            if parent == current:
+                root, checked_at = None, now
+                break
+            current = parent
+
+        for path in visited:
+            self._entries[path] = (root, checked_at)
+            self._entries.move_to_end(path)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+        return root
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+def find_config_path(repo_root):
+    """Locate the config file of the repository at `repo_root`.
+
+    Handles `gitdir:` files as used by submodules and linked worktrees.
+    The latter keep their config in the main repository's git dir,
+    which is referenced by a `commondir` file.
+    """
+    git_dir = os.path.join(repo_root, ".git")
+    if os.path.isfile(git_dir):
+        try:
+            with open(git_dir) as f:
+                content = f.read().strip()
+        except OSError:
+            return None
+        if not content.startswith("gitdir:"):
+            return None
+        git_dir = os.path.join(repo_root, content[len("gitdir:"):].strip())
+
+    try:
+        with open(os.path.join(git_dir, "commondir")) as f:
+            git_dir = os.path.join(git_dir, f.read().strip())
+    except OSError:
+        pass
+
+    return os.path.normpath(os.path.join(git_dir, "config"))
+
+
+def _stat_signature(path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (st.st_mtime_ns, st.st_size)
+
+
+class RemoteUrlCache:
+
+    """Caches the web URL of each repository's `origin` remote.
+
+    Entries are keyed by the repository root
+    and revalidated by comparing the mtime and size of the repository's config file,
+    so a cache hit costs a single `stat` call instead of spawning `git`.
+    """
+
+    def __init__(self, repo_index=None):
+        self.repo_index = repo_index or RepoRootIndex()
+        # repo root -> (config path, stat signature, url)
+        self._entries = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get_url(self, folder):
+        repo_root = self.repo_index.lookup(folder)
+        if repo_root is None:
+            return None
+
+        entry = self._entries.get(repo_root)
+        if entry is not None:
+            config_path, signature, url = entry
+            if config_path is not None and _stat_signature(config_path) == signature:
+                self.hits += 1
+                return url
+
+        self.misses += 1
+        config_path = find_config_path(repo_root)
+        signature = _stat_signature(config_path) if config_path else None
+        url = self._resolve_url(repo_root, config_path)
+        self._entries[repo_root] = (config_path, signature, url)
+        return url
+
+    def clear(self):
+        self._entries.clear()
+        self.repo_index.clear()
+        _config_urls.clear()
+
+    @staticmethod
+    def _resolve_url(repo_root, config_path):
+        try:
+            url = get_git_url_from_git(repo_root)
+        except Exception:
+            url = get_git_url_from_config(config_path) if config_path else None
+
+        if url is not None:
+            url = parse_git_url(url)
+            if url is not None:
+                return url.strip()
+
+        return None
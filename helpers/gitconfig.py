@@ -0,0 +1,273 @@
+import functools
+import logging
+import os
+import re
+
+logger = logging.getLogger(__name__)
+
+# Same limit as git itself
+MAX_INCLUDE_DEPTH = 10
+
+_SECTION = re.compile(r'\s*\[\s*([A-Za-z0-9.-]+)\s*(?:"((?:[^"\\]|\\.)*)"\s*)?\]')
+# `name = value` lines without quotes, escapes or tabs, the vast majority
+_SIMPLE_VARIABLE = re.compile(
+    r'\s*([A-Za-z][A-Za-z0-9-]*)\s*=[ \t]*([^"\\#;\s](?:[^"\\#;\t]*[^"\\#;\s])?)?\s*(?:[#;].*)?$')
+_QUOTED_VALUE = re.compile(r'\s*"([^"\\]*)"\s*(?:[#;].*)?$')
+_NAME = re.compile(r'\s*([A-Za-z][A-Za-z0-9-]*)\s*')
+_BLANK = re.compile(r'\s*(?:[#;]|$)')
+_VALUE_TOKEN = re.compile(r'"|\\(.)|\\$|[#;]|\s+|[^"\\#;\s]+')
+_SUBSECTION_ESCAPE = re.compile(r'\\(.)')
+_ESCAPES = {'n': '\n', 't': '\t', 'b': '\b', '\\': '\\', '"': '"'}
+
+
+def _parse_value(rest, lines):
+    """Parse the value starting at `rest`, consuming continuation lines from `lines`.
+
+    Follows git's rules: surrounding whitespace is dropped,
+    `"` quotes preserve whitespace and comment characters,
+    backslash escapes are decoded and a trailing backslash continues the value.
+    """
+    match = _QUOTED_VALUE.match(rest)
+    if match is not None:
+        return match.group(1)
+
+    parts = []
+    quoted = False
+    spaces = ''
+    while True:
+        for match in _VALUE_TOKEN.finditer(rest):
+            token = match.group()
+            if token == '"':
+                quoted = not quoted
+            elif token == '\\':
+                # Line continuation
+                break
+            elif match.group(1) is not None:
+                if spaces:
+                    parts.append(spaces)
+                    spaces = ''
+                parts.append(_ESCAPES.get(match.group(1), match.group(1)))
+            elif token in '#;' and not quoted:
+                return ''.join(parts)
+            elif token.isspace() and not quoted:
+                if parts:
+                    # Runs of whitespace are kept as spaces, but only between words
+                    spaces += ' ' * len(token)
+            else:
+                if spaces:
+                    parts.append(spaces)
+                    spaces = ''
+                parts.append(token)
+        else:
+            return ''.join(parts)
+
+        rest = next(lines, None)
+        if rest is None:
+            return ''.join(parts)
+        rest = rest.rstrip('\r\n')
+
+
+def _glob_to_regex(pattern):
+    """Translate a wildmatch pattern, where `*` does not match `/` but `**` does."""
+    out = []
+    i = 0
+    while i < len(pattern):
+        if pattern.startswith('**/', i):
+            out.append('(?:.*/)?')
+            i += 3
+        elif pattern.startswith('**', i):
+            out.append('.*')
+            i += 2
+        elif pattern[i] == '*':
+            out.append('[^/]*')
+            i += 1
+        elif pattern[i] == '?':
+            out.append('[^/]')
+            i += 1
+        elif pattern[i] == '[':
+            end = pattern.find(']', i + 2)
+            if end == -1:
+                out.append(re.escape(pattern[i]))
+                i += 1
+            else:
+                body = pattern[i + 1:end]
+                if body.startswith('!'):
+                    body = '^' + body[1:]
+                out.append('[%s]' % body.replace('\\', '\\\\'))
+                i = end + 1
+        else:
+            out.append(re.escape(pattern[i]))
+            i += 1
+    return ''.join(out)
+
+
+@functools.lru_cache(maxsize=64)
+def _compile_glob(pattern, ignore_case):
+    # Anchored at the end for `match`, as `fullmatch` needs Python 3.4
+    return re.compile(_glob_to_regex(pattern) + r'\Z', re.IGNORECASE if ignore_case else 0)
+
+
+def _to_slashes(path):
+    return path.replace(os.sep, '/') if os.sep != '/' else path
+
+
+def _match_gitdir(pattern, config_path, git_dir, ignore_case):
+    if git_dir is None:
+        return False
+    if pattern.startswith('./'):
+        pattern = os.path.join(os.path.dirname(config_path), pattern[2:])
+    pattern = _to_slashes(os.path.expanduser(pattern))
+    if not pattern.startswith('/') and not re.match(r'[A-Za-z]:/', pattern):
+        pattern = '**/' + pattern
+    if pattern.endswith('/'):
+        pattern += '**'
+
+    regex = _compile_glob(pattern, ignore_case)
+    git_dir = _to_slashes(os.path.abspath(git_dir))
+    return bool(regex.match(git_dir)
+                or regex.match(_to_slashes(os.path.realpath(git_dir))))
+
+
+def _match_branch(pattern, git_dir):
+    if git_dir is None:
+        return False
+    try:
+        with open(os.path.join(git_dir, 'HEAD')) as f:
+            head = f.read().strip()
+    except OSError:
+        return False
+    if not head.startswith('ref: refs/heads/'):
+        return False
+    if pattern.endswith('/'):
+        pattern += '**'
+    return bool(_compile_glob(pattern, False).match(head[len('ref: refs/heads/'):]))
+
+
+def _include_applies(condition, config_path, git_dir):
+    kind, _, pattern = condition.partition(':')
+    if kind == 'gitdir':
+        return _match_gitdir(pattern, config_path, git_dir, False)
+    if kind == 'gitdir/i':
+        return _match_gitdir(pattern, config_path, git_dir, True)
+    if kind == 'onbranch':
+        return _match_branch(pattern, git_dir)
+    logger.debug("Unsupported includeIf condition %r in %s", condition, config_path)
+    return False
+
+
+def _iter_entries(path, lines):
+    section = subsection = None
+    for line in lines:
+        line = line.rstrip('\r\n')
+        match = _SIMPLE_VARIABLE.match(line)
+        if match is not None and section is not None:
+            yield section, subsection, match.group(1).lower(), match.group(2) or ''
+            continue
+
+        match = _SECTION.match(line)
+        if match is not None:
+            section, subsection = match.group(1), match.group(2)
+            if subsection is not None:
+                subsection = _SUBSECTION_ESCAPE.sub(r'\1', subsection)
+            elif '.' in section:
+                # Deprecated `[section.subsection]` syntax
+                section, _, subsection = section.partition('.')
+                subsection = subsection.lower()
+            section = section.lower()
+            # A variable may follow the header on the same line
+            line = line[match.end():]
+
+        if _BLANK.match(line):
+            continue
+        match = _NAME.match(line)
+        if match is None or section is None:
+            logger.debug("Skipping malformed line in %s: %r", path, line)
+            continue
+
+        rest = line[match.end():]
+        if not rest or rest[0] in '#;':
+            value = None
+        elif rest[0] == '=':
+            value = _parse_value(rest[1:], lines)
+        else:
+            logger.debug("Skipping malformed line in %s: %r", path, line)
+            continue
+        yield section, subsection, match.group(1).lower(), value
+
+
+def iter_git_config(path, git_dir=None, files=None, _depth=0):
+    """Yield the `(section, subsection, name, value)` entries of a git config file in order.
+
+    Section and variable names are lowercased, as git does;
+    `subsection` is None for plain sections
+    and `value` is None for variables without `=`.
+    `[include]` and matching `[includeIf]` sections are followed in place,
+    with `git_dir` used to evaluate the conditions.
+
+    Lines are parsed as they are read,
+    so consumers can stop as soon as they found what they are looking for.
+    Malformed lines are skipped.
+    If `files` is a list, `(path, (mtime_ns, size))` is appended to it for every file opened,
+    with None as the signature of files that could not be read.
+    """
+    try:
+        f = open(path, encoding='utf-8', errors='replace')
+    except OSError:
+        if files is not None:
+            files.append((path, None))
+        return
+
+    with f:
+        if files is not None:
+            st = os.fstat(f.fileno())
+            files.append((path, (st.st_mtime_ns, st.st_size)))
+
+        for entry in _iter_entries(path, iter(f)):
+            yield entry
+
+            section, subsection, name, value = entry
+            if name != 'path' or not value:
+                continue
+            if section == 'include' and subsection is None:
+                pass
+            elif section == 'includeif' and subsection is not None:
+                if not _include_applies(subsection, path, git_dir):
+                    continue
+            else:
+                continue
+
+            if _depth >= MAX_INCLUDE_DEPTH:
+                logger.warning("Too many nested includes in %s", path)
+                continue
+            include = os.path.expanduser(value)
+            if not os.path.isabs(include):
+                include = os.path.join(os.path.dirname(path), include)
+            yield from iter_git_config(include, git_dir, files, _depth + 1)
+
+
+def git_config_parser(path, git_dir=None):
+    """Parse a whole git config file into nested dicts.
+
+    Plain sections map variable names to values,
+    sections with subsections map subsection names to those.
+    The last value of multi-valued variables wins.
+    """
+    obj = dict()
+    for section, subsection, name, value in iter_git_config(path, git_dir):
+        values = obj.setdefault(section, {})
+        if subsection is not None:
+            values = values.setdefault(subsection, {})
+        values[name] = value
+    return obj
+
+
+def find_value(path, section, subsection, name, git_dir=None, files=None):
+    """Return the first value of a variable, reading no further than needed.
+
+    The first value is what `git remote get-url` reports for multi-valued URLs.
+    """
+    for entry in iter_git_config(path, git_dir, files):
+        if entry[2] == name and entry[0] == section and entry[1] == subsection \
+                and entry[3] is not None:
+            return entry[3]
+    return None
@@ -0,0 +1,230 @@
+# List of extensions mapped to language names.
+ICONS = {
+    'asm': 'assembly',
+    'ahk': 'ahk',
+    'c,h': 'c',
+    'clj,cljs,edn': 'clojure',
+    'coffeescript,coffee': 'coffeescript',
+    'cpp,hpp,cc,hxx,cxx': 'cpp',
+    'cr': 'crystal',
+    'cs': 'cs',
+    'css': 'css',
+    'd': 'd',
+    'dart': 'dart',
+    'ejs,tmpl': 'ejs',
+    'ex,exs': 'elixir',
+    'gitignore,gitattributes,gitmodules': 'git',
+    'go': 'go',
+    'ml,mli,mll,mly': 'ocaml',
+    'hs': 'haskell',
+    'htm,html,mhtml': 'html',
+    'hx': 'haxe',
+    'j2,jinja,jinja2': 'jinja',
+    'java,class,properties': 'java',
+    'js': 'javascript',
+    'json': 'json',
+    'jsx,tsx': 'react',
+    'kt': 'kotlin',
+    'lua': 'lua',
+    'md': 'markdown',
+    'php': 'php',
+    'png,jpg,jpeg,jfif,gif,webp': 'image',
+    'py,pyx': 'python',
+    'p,sp': 'pawn',
+    'r,rda,rdata,rds,rhistory': 'r',
+    'rb': 'ruby',
+    'rs': 'rust',
+    'sh,bat': 'shell',
+    'swift': 'swift',
+    'svelte': 'svelte',
+    't': 'perl',
+    'toml': 'toml',
+    'ts': 'typescript',
+    'tex,bib': 'latex',
+    'txt,rst,rest': 'text',
+    'vue': 'vue',
+    'xml,svg,yml,yaml,cfg,ini': 'xml',
+    'yar,yara': 'yara',
+    'pp,pas,inc': 'pascal',
+    'scss,sass': 'sass',
+    'nim': 'nim',
+    'nite,nitecode,nightcode,nc': 'nitecode',
+    'p6,pm6,pod6,raku,rakumod,rakudoc,rakutest,nqp,crotmp': 'raku',
+    'gml,yy': 'gml',
+    'factor,facts': 'factor'
+}
+
+# Scopes we can/should fallback to
+SCOPES = {
+    'assembly',
+    'ahk',
+    'c',
+    'clojure',
+    'cpp',
+    'cs',
+    'css',
+    'd',
+    'erlang',
+    'haxe',
+    'html',
+    'java',
+    'json',
+    'latex',
+    'pde',
+    'perl',
+    'php',
+    'pawn',
+    'python',
+    'r',
+    'scala',
+    'svelte',
+    'yara',
+    'pascal',
+    'ocaml',
+    'v',
+    'sass',
+    'nim',
+    'nitecode',
+    'raku',
+    'gml',
+    'factor'
+}
+
+# Scopes mapped to language names, for syntaxes whose scope is not named after the icon.
+# The longest matching prefix wins, so more specific scopes can be added freely.
+SCOPE_ICONS = {
+    'source.batchfile': 'batch',
+    'source.dosbatch': 'batch',
+    'source.c++': 'cpp',
+    'source.objc++': 'cpp',
+    'source.coffee': 'coffeescript',
+    'source.crystal': 'crystal',
+    'source.dart': 'dart',
+    'source.elixir': 'elixir',
+    'source.fsharp': 'fs',
+    'source.go': 'go',
+    'source.haskell': 'haskell',
+    'source.js': 'javascript',
+    'source.jsx': 'react',
+    'source.kotlin': 'kotlin',
+    'source.lisp': 'lisp',
+    'source.lua': 'lua',
+    'source.ruby': 'ruby',
+    'source.rust': 'rust',
+    'source.shell': 'shell',
+    'source.swift': 'swift',
+    'source.toml': 'toml',
+    'source.ts': 'typescript',
+    'source.tsx': 'react',
+    'source.yaml': 'xml',
+    'text.html.jinja': 'jinja',
+    'text.html.markdown': 'markdown',
+    'text.html.vue': 'vue',
+    'text.plain': 'text',
+    'text.restructuredtext': 'text',
+    'text.tex.latex': 'latex',
+    'text.xml': 'xml',
+}
+
+# Icons that are chosen by file name rather than by extension.
+FILE_ICONS = {
+    'LICENSE': 'license',
+}
+
+UNKNOWN_ICON = 'unknown'
+
+
+# Key of the icon of a node in ScopeTrie
+_ICON = None
+
+
+class ScopeTrie:
+
+    """Maps scope names to icons by longest match on their dot-separated segments.
+
+    `scopes` maps full scope names (e.g. "text.html.markdown") to icons.
+    `subscopes` are icon names matched against scopes without their first segment,
+    so "python" matches "source.python".
+    On equal length, full scope names take precedence.
+    """
+
+    def __init__(self, scopes=SCOPE_ICONS, subscopes=SCOPES):
+        self._root = {}
+        for scope, icon in scopes.items():
+            self._insert(self._root, scope, icon)
+        self._any = {}
+        for scope in subscopes:
+            self._insert(self._any, scope, scope)
+
+    @staticmethod
+    def _insert(node, scope, icon):
+        for segment in scope.split('.'):
+            node = node.setdefault(segment, {})
+        node[_ICON] = icon
+
+    @staticmethod
+    def _walk(node, segments, start):
+        """Return the depth and icon of the deepest node with an icon along `segments`."""
+        depth = 0
+        icon = None
+        for i in range(start, len(segments)):
+            node = node.get(segments[i])
+            if node is None:
+                break
+            if _ICON in node:
+                depth = i + 1
+                icon = node[_ICON]
+        return depth, icon
+
+    def lookup(self, scope):
+        """Return the icon for a single scope name, or None."""
+        segments = scope.split('.')
+        depth, icon = self._walk(self._root, segments, 0)
+        any_depth, any_icon = self._walk(self._any, segments, 1)
+        if any_depth > depth:
+            return any_icon
+        return icon
+
+    def resolve(self, scope_stack):
+        """Return the icon of the outermost scope of a space-separated stack that has one."""
+        for scope in scope_stack.split():
+            icon = self.lookup(scope)
+            if icon is not None:
+                return icon
+        return None
+
+
+class IconResolver:
+
+    """Resolves the icon name for a file from its name, extension and scope.
+
+    The lookup tables are flattened once on construction,
+    so resolving an icon costs one or two dict lookups.
+    Icons found from the scope are cached per syntax file,
+    or per outermost scope when the syntax is not given.
+    Build a new instance when the overrides change.
+    """
+
+    def __init__(self, overrides=None, icons=ICONS, scopes=SCOPES, scope_icons=SCOPE_ICONS):
+        by_ext = {}
+        for exts, icon in icons.items():
+            for ext in exts.split(','):
+                by_ext.setdefault(ext, icon)
+        if overrides:
+            for ext, icon in overrides.items():
+                by_ext[ext.lstrip('.')] = icon
+        self._by_ext = by_ext
+        self._scope_trie = ScopeTrie(scope_icons, scopes)
+        # Syntax file or first scope token -> icon, filled on demand
+        self._by_scope = {}
+
+    def resolve(self, file, ext, scope, syntax=None):
+        icon = FILE_ICONS.get(file)
+        if icon is None:
+            icon = self._by_ext.get(ext)
+        if icon is None:
+            key = syntax or (scope.split(None, 1)[0] if scope else '')
+            icon = self._by_scope.get(key)
+            if icon is None:
+                icon = self._by_scope[key] = self._scope_trie.resolve(scope) or UNKNOWN_ICON
+        return icon
@@ -0,0 +1,70 @@
+import threading
+
+
+class BufferMetrics:
+
+    __slots__ = ('change_count', 'size', 'lines')
+
+    def __init__(self, change_count, size, lines):
+        self.change_count = change_count
+        self.size = size
+        self.lines = lines
+
+
+class BufferMetricsCache:
+
+    """Size and line count of buffers, keyed by buffer id.
+
+    Entries are valid for the change count they were computed at
+    and are kept up to date incrementally from text change notifications,
+    so the full computation only runs when a buffer is first seen
+    or when changes could not be applied.
+    """
+
+    def __init__(self):
+        self._entries = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, view):
+        """Return the metrics for the buffer of `view`."""
+        buffer_id = view.buffer_id()
+        change_count = view.change_count()
+        with self._lock:
+            entry = self._entries.get(buffer_id)
+            if entry is not None and entry.change_count == change_count:
+                self.hits += 1
+                return entry
+
+        size = view.size()
+        entry = BufferMetrics(change_count, size, view.rowcol(size)[0] + 1)
+        with self._lock:
+            self.misses += 1
+            # Not stored if the buffer was edited while reading it,
+            # as the pending change notification would be applied on top of the edit again
+            if view.change_count() == change_count:
+                self._entries[buffer_id] = entry
+        return entry
+
+    def apply_changes(self, buffer_id, previous_change_count, change_count, changes):
+        """Update an entry with the `sublime.TextChange`s
+        that took the buffer from `previous_change_count` to `change_count`.
+        """
+        with self._lock:
+            entry = self._entries.get(buffer_id)
+            if entry is None or entry.change_count == change_count:
+                return
+            if entry.change_count != previous_change_count:
+                # Computed in the middle of this batch of changes, cannot tell what is included
+                del self._entries[buffer_id]
+                return
+
+            for change in changes:
+                entry.size += len(change.str) - (change.b.pt - change.a.pt)
+                entry.lines += change.str.count('\n') - (change.b.row - change.a.row)
+            entry.change_count = change_count
+
+    def discard(self, buffer_id):
+        with self._lock:
+            self._entries.pop(buffer_id, None)
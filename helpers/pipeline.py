@@ -0,0 +1,203 @@
+from collections import OrderedDict
+import heapq
+import itertools
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class StageStats:
+
+    """Number of runs and latency of a pipeline stage, in seconds."""
+
+    __slots__ = ('count', 'total', 'max', 'last')
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.last = 0.0
+
+    def record(self, seconds):
+        self.count += 1
+        self.total += seconds
+        self.last = seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    @property
+    def mean(self):
+        return self.total / self.count if self.count else 0.0
+
+    def as_dict(self):
+        return {'count': self.count, 'mean': self.mean, 'max': self.max, 'last': self.last}
+
+
+class _Job:
+
+    __slots__ = ('seq', 'func', 'queued_at')
+
+    def __init__(self, seq, func):
+        self.seq = seq
+        self.func = func
+        self.queued_at = time.perf_counter()
+
+
+class ActivityPipeline:
+
+    """Moves building and sending activities off the caller's thread.
+
+    The caller gathers what it needs from the editor
+    and `submit`s a job computing the activity, keyed by window.
+    Jobs run on a pool of `workers` threads (the enrich stage).
+    Only the newest job per key is kept while waiting,
+    and at most `max_pending` jobs wait at all, the oldest being dropped.
+    Results are passed to `publish` in submission order:
+    a result finishing after a newer one was published is dropped as stale.
+    `schedule` runs callbacks on a single sender thread (the send stage),
+    with the same signature as `sublime.set_timeout_async`.
+
+    Latency of each stage is available from `stats`,
+    including 'gather', which callers record themselves.
+    """
+
+    STAGES = ('gather', 'queue', 'enrich', 'send')
+
+    def __init__(self, publish, workers=2, max_pending=8):
+        self.publish = publish
+        self.workers = workers
+        self.max_pending = max_pending
+        self._lock = threading.Condition()
+        # key -> _Job, oldest first
+        self._pending = OrderedDict()
+        self._seq = itertools.count(1)
+        self._published_seq = 0
+        # (due time, order, callback)
+        self._timers = []
+        self._threads = []
+        self._running = False
+        # Incremented on every start, so threads of a previous run exit
+        self._generation = 0
+        self.stages = {name: StageStats() for name in self.STAGES}
+        self.dropped = 0
+        self.superseded = 0
+        self.stale = 0
+
+    @property
+    def depth(self):
+        """Number of jobs waiting for a worker."""
+        return len(self._pending)
+
+    def start(self):
+        with self._lock:
+            if self._running:
+                return
+            self._running = True
+            self._generation += 1
+            self._threads = [threading.Thread(target=self._work, args=(self._generation,),
+                                              name="discordrp-worker-%d" % i, daemon=True)
+                             for i in range(self.workers)]
+            self._threads.append(threading.Thread(target=self._send_loop, args=(self._generation,),
+                                                  name="discordrp-sender", daemon=True))
+        for thread in self._threads:
+            thread.start()
+
+    def stop(self):
+        """Stop the threads, dropping waiting jobs and callbacks."""
+        with self._lock:
+            self._running = False
+            self._pending.clear()
+            self._timers.clear()
+            self._lock.notify_all()
+        self._threads = []
+
+    def record(self, stage, seconds):
+        with self._lock:
+            self.stages[stage].record(seconds)
+
+    def submit(self, key, func):
+        """Queue `func()` to compute the result for `key`, replacing a job waiting for the same key."""
+        with self._lock:
+            job = _Job(next(self._seq), func)
+            if key in self._pending:
+                self.superseded += 1
+                # Keep its place in the queue, so busy windows do not starve the others
+                self._pending[key] = job
+            else:
+                self._pending[key] = job
+                if len(self._pending) > self.max_pending:
+                    self._pending.popitem(last=False)
+                    self.dropped += 1
+            # The sender thread waits on the same condition
+            self._lock.notify_all()
+
+    def schedule(self, callback, delay=0):
+        """Run `callback` on the sender thread after `delay` milliseconds."""
+        with self._lock:
+            heapq.heappush(self._timers, (time.monotonic() + delay / 1000, next(self._seq), callback))
+            self._lock.notify_all()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'depth': len(self._pending),
+                'dropped': self.dropped,
+                'superseded': self.superseded,
+                'stale': self.stale,
+                'stages': {name: stats.as_dict() for name, stats in self.stages.items()},
+            }
+
+    def _is_current(self, generation):
+        return self._running and self._generation == generation
+
+    def _work(self, generation):
+        while True:
+            with self._lock:
+                while self._is_current(generation) and not self._pending:
+                    self._lock.wait()
+                if not self._is_current(generation):
+                    return
+                _, job = self._pending.popitem(last=False)
+                started = time.perf_counter()
+                self.stages['queue'].record(started - job.queued_at)
+
+            try:
+                result = job.func()
+            except Exception:
+                logger.exception("Error while building activity")
+                continue
+            finally:
+                finished = time.perf_counter()
+                with self._lock:
+                    self.stages['enrich'].record(finished - started)
+
+            if result is None:
+                continue
+            with self._lock:
+                if job.seq < self._published_seq:
+                    self.stale += 1
+                    continue
+                self._published_seq = job.seq
+                # Called with the (reentrant) lock held so results cannot overtake each other
+                self.publish(result)
+
+    def _send_loop(self, generation):
+        while True:
+            with self._lock:
+                while self._is_current(generation):
+                    now = time.monotonic()
+                    if self._timers and self._timers[0][0] <= now:
+                        break
+                    self._lock.wait(self._timers[0][0] - now if self._timers else None)
+                if not self._is_current(generation):
+                    return
+                _, _, callback = heapq.heappop(self._timers)
+
+            started = time.perf_counter()
+            try:
+                callback()
+            except Exception:
+                logger.exception("Error while sending activity")
+            self.record('send', time.perf_counter() - started)
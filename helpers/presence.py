@@ -0,0 +1,130 @@
+from collections import OrderedDict
+
+# Number of files per window whose activity is remembered
+MAX_FILES = 32
+
+
+class FilePresence:
+
+    """Last activity built for a file, valid while its buffer is unchanged."""
+
+    __slots__ = ('change_count', 'activity')
+
+    def __init__(self, change_count, activity):
+        self.change_count = change_count
+        self.activity = activity
+
+
+class WindowPresence:
+
+    """What a window last showed: its file, since when, and recent activities per file."""
+
+    __slots__ = ('last_file', 'last_edit', 'stamp', 'files')
+
+    def __init__(self, stamp):
+        self.last_file = ''
+        self.last_edit = 0
+        self.stamp = stamp
+        # file name -> FilePresence, oldest first
+        self.files = OrderedDict()
+
+    def cached_activity(self, file, change_count):
+        """Return the activity last built for `file` if its buffer did not change since."""
+        entry = self.files.get(file)
+        if entry is None or entry.change_count != change_count:
+            return None
+        return entry.activity
+
+    def remember(self, file, change_count, activity):
+        # Called from the worker threads, while the others only read
+        files = self.files
+        files.pop(file, None)
+        files[file] = FilePresence(change_count, activity)
+        while len(files) > MAX_FILES:
+            files.popitem(last=False)
+
+
+class PresenceTracker:
+
+    """Presence state of every window and which one owns the presence.
+
+    With the 'focused' policy, the most recently focused window owns the presence
+    and each window keeps its own file and timestamps,
+    so switching between windows does not reset them.
+    With 'pinned', only the pinned window updates the presence;
+    the first window to do so is pinned unless `pin` was called.
+    With 'aggregated', all windows share one state, like a single window would.
+    """
+
+    __slots__ = ('policy', 'session_start', 'windows', 'owner', 'pinned', 'idle_generation')
+
+    def __init__(self, session_start, policy='focused'):
+        self.policy = policy
+        self.session_start = session_start
+        # window id (None when aggregated) -> WindowPresence
+        self.windows = {}
+        # Window id whose activity was presented last
+        self.owner = None
+        self.pinned = None
+        # Incremented whenever focus moves, to cancel pending idle resets
+        self.idle_generation = 0
+
+    def _key(self, window_id):
+        return None if self.policy == 'aggregated' else window_id
+
+    def window(self, window_id):
+        key = self._key(window_id)
+        state = self.windows.get(key)
+        if state is None:
+            state = self.windows[key] = WindowPresence(self.session_start)
+        return state
+
+    def owns(self, window_id):
+        """Whether the activity of `window_id` should be presented."""
+        if self.policy == 'pinned':
+            if self.pinned is None:
+                self.pinned = window_id
+            return self.pinned == window_id
+        return True
+
+    def present(self, window_id):
+        """Record that `window_id` is presented, returning whether it was already."""
+        key = self._key(window_id)
+        presented = self.owner == key
+        self.owner = key
+        return presented
+
+    def pin(self, window_id):
+        self.pinned = window_id
+
+    def discard_window(self, window_id):
+        if self.policy != 'aggregated':
+            self.windows.pop(window_id, None)
+        if self.pinned == window_id:
+            self.pinned = None
+        if self.owner == window_id:
+            self.owner = None
+
+    def set_policy(self, policy):
+        if policy != self.policy:
+            self.policy = policy
+            self.windows.clear()
+            self.owner = self.pinned = None
+
+    def forget_activities(self):
+        """Drop cached activities, e.g. when the settings affecting them changed."""
+        for state in list(self.windows.values()):
+            # Replaced rather than cleared, as workers may be adding to it
+            state.files = OrderedDict()
+
+    def forget_window_activities(self, window_id):
+        """Drop the cached activities of a window, e.g. when its folders changed."""
+        state = self.windows.get(self._key(window_id))
+        if state is not None:
+            state.files = OrderedDict()
+
+    def reset(self):
+        """Forget what was presented, so that the next activity is always sent."""
+        self.owner = None
+        for state in self.windows.values():
+            state.last_file = ''
@@ -0,0 +1,54 @@
+import os
+
+# Key marking the end of a folder's path in the trie
+_FOLDER = object()
+
+
+def _components(path):
+    return os.path.normcase(os.path.realpath(path)).split(os.sep)
+
+
+class FolderIndex:
+
+    """Finds the folder containing a path by longest prefix on path components.
+
+    The real paths of the folders are resolved once, when building the index.
+    Comparing components means `/proj` does not contain `/project2/file`.
+    """
+
+    def __init__(self, folders):
+        self.folders = tuple(folders)
+        self._trie = {}
+        for folder in self.folders:
+            node = self._trie
+            for part in _components(folder):
+                node = node.setdefault(part, {})
+            node.setdefault(_FOLDER, folder)
+
+    def find(self, path):
+        """Return the innermost folder containing `path`, or None."""
+        node = self._trie
+        found = None
+        for part in _components(path):
+            node = node.get(part)
+            if node is None:
+                break
+            found = node.get(_FOLDER, found)
+        return found
+
+
+class WindowIndex:
+
+    """Per-window state for resolving project names.
+
+    Rebuild it when `is_current` returns False for the window.
+    """
+
+    def __init__(self, folders, project_file):
+        self.folders = FolderIndex(folders)
+        self.project_file = project_file
+        # File path -> resolved project name
+        self.projects = {}
+
+    def is_current(self, folders, project_file):
+        return self.folders.folders == tuple(folders) and self.project_file == project_file
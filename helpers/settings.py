@@ -0,0 +1,83 @@
+import logging
+from types import MappingProxyType
+
+logger = logging.getLogger(__name__)
+
+NUMBER = (int, float)
+OPTIONAL_NUMBER = (int, float, type(None))
+OPTIONAL_STR = (str, type(None))
+
+PROJECT_NAME_SOURCES = ('project_file_name', 'project_folder_name', 'folder_name')
+WINDOW_POLICIES = ('focused', 'pinned', 'aggregated')
+
+# Name, accepted types and default value of every setting
+SCHEMA = (
+    ('connect_on_startup', bool, True),
+    ('details', OPTIONAL_STR, "Editing {file} for Project {project}"),
+    ('state', OPTIONAL_STR, "Size: {sizehf}"),
+    ('start_state', OPTIONAL_STR, "Just launched"),
+    ('time_per_file', bool, True),
+    ('show_elapsed_time', bool, True),
+    ('small_icon', bool, False),
+    ('big_icon', bool, True),
+    ('icon_overrides', dict, {}),
+    ('git_repository_button', bool, False),
+    ('git_repository_message', OPTIONAL_STR, "Open Repository"),
+    ('project_name', list, list(PROJECT_NAME_SOURCES)),
+    ('update_interval', NUMBER, 4),
+    ('connect_timeout', OPTIONAL_NUMBER, 2),
+    ('handshake_timeout', OPTIONAL_NUMBER, 5),
+    ('connection_timeout', OPTIONAL_NUMBER, 6),
+    ('request_timeout', OPTIONAL_NUMBER, 5),
+    ('idle_timeout', NUMBER, 0),
+    ('window_policy', str, 'focused'),
+    ('performance_stats', bool, False),
+    ('profiler', bool, False),
+)
+
+
+class SettingsSnapshot:
+
+    """Read-only, validated copy of the package settings.
+
+    Built from a `sublime.Settings` object (or anything with a `get` method)
+    whenever the settings change,
+    so that the hot path reads plain attributes.
+    Invalid values are reported once and replaced by their defaults.
+    """
+
+    __slots__ = tuple(name for name, _, _ in SCHEMA)
+
+    def __init__(self, settings):
+        for name, types, default in SCHEMA:
+            value = settings.get(name, default)
+            if not isinstance(value, types):
+                logger.error("Setting `%s` has an invalid value %r, using %r instead",
+                             name, value, default)
+                value = default
+            object.__setattr__(self, name, value)
+
+        self._validate_project_name()
+        if self.window_policy not in WINDOW_POLICIES:
+            logger.error("Unknown value for `window_policy` setting: %r, using 'focused' instead",
+                         self.window_policy)
+            object.__setattr__(self, 'window_policy', 'focused')
+        # Freeze mutable values
+        object.__setattr__(self, 'project_name', tuple(self.project_name))
+        object.__setattr__(self, 'icon_overrides', MappingProxyType(dict(self.icon_overrides)))
+
+    def _validate_project_name(self):
+        sources = []
+        for source in self.project_name:
+            if source in PROJECT_NAME_SOURCES:
+                sources.append(source)
+            else:
+                logger.error("Unknown source for `project_name` setting: %r", source)
+        object.__setattr__(self, 'project_name', sources)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("settings snapshots are read-only")
+
+    def __repr__(self):
+        return "SettingsSnapshot(%s)" % ", ".join(
+            "%s=%r" % (name, getattr(self, name)) for name in self.__slots__)
@@ -0,0 +1,179 @@
+from collections import Counter
+import os
+import sys
+import threading
+import time
+
+
+class Histogram:
+
+    """Keeps the last `size` samples in a ring buffer, plus totals over all of them."""
+
+    __slots__ = ('samples', 'index', 'count', 'total', 'max')
+
+    def __init__(self, size=256):
+        self.samples = [0.0] * size
+        self.index = 0
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, value):
+        self.samples[self.index] = value
+        self.index = (self.index + 1) % len(self.samples)
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    def recent(self):
+        return sorted(self.samples[:min(self.count, len(self.samples))])
+
+    def percentile(self, p, recent=None):
+        """Return the `p`th percentile (0-100) of the recent samples."""
+        if recent is None:
+            recent = self.recent()
+        if not recent:
+            return 0.0
+        return recent[min(len(recent) - 1, int(len(recent) * p / 100))]
+
+
+class Stats:
+
+    """Timings and counters of the hot paths, recorded only while `enabled`.
+
+    Time a region with
+
+        started = stats.clock()
+        ...
+        stats.record('name', started)
+
+    When disabled, `clock` returns None and `record` returns right away,
+    so instrumented code costs two calls.
+    `record` also ignores times taken with `time.perf_counter` directly while disabled.
+    """
+
+    def __init__(self, enabled=False, size=256):
+        self.enabled = enabled
+        self.size = size
+        self.histograms = {}
+        self.counters = Counter()
+        self._lock = threading.Lock()
+
+    def clock(self):
+        return time.perf_counter() if self.enabled else None
+
+    def record(self, name, started):
+        """Record the time elapsed since `started`, as returned by `clock`."""
+        if started is None or not self.enabled:
+            return
+        self.add(name, time.perf_counter() - started)
+
+    def add(self, name, value):
+        with self._lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = Histogram(self.size)
+            histogram.add(value)
+
+    def count(self, name, n=1):
+        if self.enabled:
+            with self._lock:
+                self.counters[name] += n
+
+    def reset(self):
+        with self._lock:
+            self.histograms.clear()
+            self.counters.clear()
+
+    def report(self):
+        """Format the timings in milliseconds and the counters as lines of text."""
+        lines = []
+        with self._lock:
+            histograms = sorted(self.histograms.items())
+            counters = sorted(self.counters.items())
+        if histograms:
+            lines.append("%-22s %8s %9s %9s %9s %9s" % ("timing (ms)", "count", "p50", "p90",
+                                                        "p99", "max"))
+            for name, histogram in histograms:
+                recent = histogram.recent()
+                lines.append("%-22s %8d %9.3f %9.3f %9.3f %9.3f" % (
+                    name, histogram.count,
+                    histogram.percentile(50, recent) * 1000,
+                    histogram.percentile(90, recent) * 1000,
+                    histogram.percentile(99, recent) * 1000,
+                    histogram.max * 1000))
+        if counters:
+            lines.append("")
+            lines.extend("%-22s %8d" % item for item in counters)
+        return lines
+
+
+class SamplingProfiler:
+
+    """Samples the stacks of all threads every `interval` seconds from a background thread.
+
+    Counts the innermost frame that belongs to a file under `root`,
+    so the report shows where the package itself spends its time,
+    whichever thread it runs on.
+    Threads waiting in `threading`, or directly in one of the `idle` functions
+    (which block in system calls), are not counted.
+    """
+
+    def __init__(self, root, interval=0.005, idle=()):
+        self.root = os.path.normcase(os.path.abspath(root))
+        self.interval = interval
+        self.idle = frozenset(idle)
+        self.samples = Counter()
+        self.total = 0
+        self._stop_event = None
+
+    @property
+    def running(self):
+        return self._stop_event is not None
+
+    def start(self):
+        if self._stop_event is not None:
+            return
+        self._stop_event = threading.Event()
+        threading.Thread(target=self._run, args=(self._stop_event,),
+                         name="discordrp-profiler", daemon=True).start()
+
+    def stop(self):
+        if self._stop_event is not None:
+            self._stop_event.set()
+            self._stop_event = None
+
+    def _run(self, stop_event):
+        own_id = threading.get_ident()
+        waiting = threading.__file__
+        # Frame file name -> whether it belongs to the package
+        in_package = {}
+        while not stop_event.wait(self.interval):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id or frame.f_code.co_filename == waiting:
+                    continue
+                if frame.f_code.co_name in self.idle:
+                    continue
+                while frame is not None:
+                    code = frame.f_code
+                    filename = code.co_filename
+                    inside = in_package.get(filename)
+                    if inside is None:
+                        inside = in_package[filename] = os.path.normcase(
+                            os.path.abspath(filename)).startswith(self.root)
+                    if inside:
+                        self.samples[(filename, code.co_name, frame.f_lineno)] += 1
+                        self.total += 1
+                        break
+                    frame = frame.f_back
+
+    def report(self, limit=20):
+        lines = ["%-8s %6s  %s" % ("samples", "%", "location")]
+        # Copied at once, as the sampling thread keeps adding to it
+        samples = Counter(dict(self.samples))
+        for (filename, function, line), count in samples.most_common(limit):
+            lines.append("%-8d %5.1f%%  %s:%d %s" % (
+                count, count * 100 / self.total,
+                os.path.relpath(filename, self.root), line, function))
+        return lines
@@ -0,0 +1,64 @@
+import os
+
+
+class SyntaxInfo:
+
+    """What the presence needs to know about a syntax file."""
+
+    __slots__ = ('path', 'language', 'scope')
+
+    def __init__(self, path, language, scope):
+        self.path = path
+        self.language = language
+        self.scope = scope
+
+
+def language_from_path(path):
+    """Derive a language name from the file name of a syntax."""
+    language = os.path.splitext(os.path.basename(path))[0]
+    if len(language) < 2:
+        language = language.upper() + ' Syntax'
+    return language
+
+
+class SyntaxCache:
+
+    """Language name and base scope of syntax files, keyed by the syntax's path.
+
+    `find_syntax(path)` should return an object with `name` and `scope` attributes,
+    like `sublime.syntax_from_path` on ST4, or None if the syntax is unknown.
+    Without it, or if it fails, the language is derived from the file name
+    and the scope is read from the first view using the syntax.
+    Entries never go stale on their own as a view changing its syntax has a different key;
+    call `clear` when syntax definitions may have been reloaded.
+    """
+
+    def __init__(self, find_syntax=None):
+        self._find_syntax = find_syntax
+        self._entries = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, path, view_scope):
+        """Return the SyntaxInfo for `path`,
+        calling `view_scope()` for the scope if the syntax cannot be looked up.
+        """
+        info = self._entries.get(path)
+        if info is not None:
+            self.hits += 1
+            return info
+
+        self.misses += 1
+        syntax = self._find_syntax(path) if self._find_syntax and path else None
+        if syntax is not None:
+            info = SyntaxInfo(path, syntax.name, syntax.scope)
+        else:
+            info = SyntaxInfo(path, language_from_path(path or 'Plain Text'), view_scope())
+        self._entries[path] = info
+        return info
+
+    def discard(self, path):
+        self._entries.pop(path, None)
+
+    def clear(self):
+        self._entries.clear()
@@ -0,0 +1,108 @@
+import logging
+from string import Formatter
+
+logger = logging.getLogger(__name__)
+
+
+def _escape(text):
+    return text.replace('{', '{{').replace('}', '}}')
+
+
+def _root(field_name):
+    return field_name.partition('.')[0].partition('[')[0]
+
+
+def _nested_roots(format_spec):
+    """Return the roots of the fields nested in a format spec, as in `{file:>{width}}`.
+
+    Raises ValueError if the spec is malformed or nests fields deeper than `str.format` allows.
+    """
+    roots = set()
+    for _, field_name, spec, _ in Formatter().parse(format_spec or ''):
+        if field_name is None:
+            continue
+        if spec and '{' in spec:
+            raise ValueError("replacement fields nested too deeply")
+        roots.add(_root(field_name))
+    return roots
+
+
+class Template:
+
+    """A `str.format` template parsed once, knowing the fields it references.
+
+    Fields missing from `known_fields` are reported when compiling
+    and rendered literally instead of raising KeyError,
+    as are fields whose format spec references one.
+    A malformed template is reported and rendered as plain text.
+    """
+
+    def __init__(self, source, known_fields, name='template'):
+        self.source = source
+        fields = set()
+        unknown = set()
+        try:
+            parts = list(Formatter().parse(source))
+        except ValueError as e:
+            logger.error("Invalid format string in `%s` setting: %s", name, e)
+            parts = [(source, None, None, None)]
+
+        compiled = []
+        for literal, field_name, format_spec, conversion in parts:
+            compiled.append(_escape(literal))
+            if field_name is None:
+                continue
+            field = '{%s%s%s}' % (field_name,
+                                  '!' + conversion if conversion else '',
+                                  ':' + format_spec if format_spec else '')
+            try:
+                roots = _nested_roots(format_spec)
+            except ValueError as e:
+                logger.error("Invalid format spec in `%s` setting: %s", name, e)
+                compiled.append(_escape(field))
+                continue
+            roots.add(_root(field_name))
+            missing = {root for root in roots if root not in known_fields}
+            if missing:
+                unknown |= missing
+                compiled.append(_escape(field))
+            else:
+                fields |= roots
+                compiled.append(field)
+
+        if unknown:
+            logger.error("Unknown fields in `%s` setting: %s",
+                         name, ', '.join('{%s}' % field for field in sorted(unknown)))
+        self.fields = frozenset(fields)
+        self.unknown_fields = frozenset(unknown)
+        self._format = ''.join(compiled)
+
+    def render(self, values):
+        """Render the template, looking up only the fields it references in `values`."""
+        return self._format.format_map(values)
+
+
+def compile_template(source, known_fields, name='template'):
+    """Compile `source`, returning None for empty templates."""
+    if not source:
+        return None
+    return Template(source, known_fields, name)
+
+
+class LazyFields(dict):
+
+    """Template values computed on first access, at most once.
+
+    `providers` maps field names to functions
+    that are called with this object to compute the field's value.
+    The keyword arguments are available as attributes to the providers.
+    """
+
+    def __init__(self, providers, **context):
+        super().__init__()
+        self._providers = providers
+        self.__dict__.update(context)
+
+    def __missing__(self, key):
+        value = self[key] = self._providers[key](self)
+        return value
@@ -0,0 +1,126 @@
+import ctypes
+import ctypes.util
+from functools import partial
+import logging
+import os
+import select
+import struct
+import sys
+import threading
+
+logger = logging.getLogger(__name__)
+
+IN_CREATE = 0x00000100
+IN_MOVED_TO = 0x00000080
+_event_header = struct.Struct("iIII")
+
+
+class DirectoryWatcher:
+
+    """Calls `callback(name)` from a background thread
+    when an entry matching `match(name)` is created in one of `dirs`.
+
+    Uses inotify on Linux, so the thread sleeps until something happens.
+    Elsewhere the directories' mtimes are checked every `poll_interval` seconds.
+    """
+
+    def __init__(self, dirs, match, callback, poll_interval=2.0):
+        self.dirs = [path for path in dirs if os.path.isdir(path)]
+        self.match = match
+        self.callback = callback
+        self.poll_interval = poll_interval
+        self._thread = None
+        self._stop_event = None
+        self._stop_w = None
+
+    @property
+    def running(self):
+        return self._thread is not None
+
+    def start(self):
+        if self._thread or not self.dirs:
+            return
+        self._stop_event = threading.Event()
+        target = partial(self._poll, self._stop_event)
+        inotify_fd = _inotify_init(self.dirs)
+        if inotify_fd is not None:
+            stop_r, self._stop_w = os.pipe()
+            target = partial(self._read_inotify, inotify_fd, self._stop_event, stop_r, self._stop_w)
+        self._thread = threading.Thread(target=target, name="discordrp-watcher", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if not self._thread:
+            return
+        self._stop_event.set()
+        if self._stop_w is not None:
+            os.write(self._stop_w, b"x")
+            self._stop_w = None
+        self._thread = None
+
+    def _notify(self, name):
+        try:
+            self.callback(name)
+        except Exception:
+            logger.exception("Error in directory watcher callback")
+
+    def _poll(self, stop_event):
+        mtimes = {path: _mtime(path) for path in self.dirs}
+        while not stop_event.wait(self.poll_interval):
+            for path in self.dirs:
+                mtime = _mtime(path)
+                if mtime == mtimes[path]:
+                    continue
+                mtimes[path] = mtime
+                try:
+                    names = os.listdir(path)
+                except OSError:
+                    continue
+                for name in names:
+                    if self.match(name):
+                        self._notify(name)
+                        break
+
+    def _read_inotify(self, fd, stop_event, stop_r, stop_w):
+        try:
+            while not stop_event.is_set():
+                readable, _, _ = select.select([fd, stop_r], [], [])
+                if stop_r in readable:
+                    break
+                data = os.read(fd, 4096)
+                offset = 0
+                while offset < len(data):
+                    _, _, _, length = _event_header.unpack_from(data, offset)
+                    offset += _event_header.size
+                    name = data[offset:offset + length].rstrip(b"\0").decode('utf-8', 'replace')
+                    offset += length
+                    if self.match(name):
+                        self._notify(name)
+        finally:
+            os.close(fd)
+            os.close(stop_r)
+            os.close(stop_w)
+
+
+def _mtime(path):
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+
+
+def _inotify_init(dirs):
+    """Return an inotify fd watching `dirs` for new entries, or None if unavailable."""
+    if not sys.platform.startswith('linux'):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        fd = libc.inotify_init()
+    except (OSError, AttributeError):
+        return None
+    if fd < 0:
+        return None
+    for path in dirs:
+        if libc.inotify_add_watch(fd, path.encode(), IN_CREATE | IN_MOVED_TO) < 0:
+            logger.debug("Unable to watch %r: %s", path, os.strerror(ctypes.get_errno()))
+    return fd